@@ -0,0 +1,360 @@
+import os
+import re
+import glob
+import json
+import time
+import shutil
+import zipfile
+import calendar
+import eccodes
+
+from gen_dirs import (
+    log_message,
+    select_output_directory,
+    process_zip_file,
+    calculate_wind_speed_with_pygrib,
+)
+from pipeline import stage_pool
+
+# ----------------------
+# 配置参数
+# ----------------------
+# 需要监视的下载目录（按天的 YYYY-MM-DD.zip、整月的 YYYY-MM_partial.zip 或 YYYY-MM.grib）
+watch_directories = [
+    r"M:\era5",
+    r"G:\era5",
+    r"F:\data_from_era5",
+]
+merge_directory = r"M:\era5\output"  # 按天数据合并后的月文件目录
+output_directories = [
+    r"M:\windspeed",
+    r"G:\windspeed",
+    r"F:\windspeed"
+]
+cache_directory = r"E:\temp"
+state_file = "ingest_state.json"  # 旧版本记录已合并日期的文件，现在只在月份没有合并记录时读取
+
+poll_interval = 30     # 轮询间隔（秒）
+stable_seconds = 120   # 文件大小和修改时间保持不变多久才认为下载完成（秒）
+max_workers = 2        # 同时运行的合并/转换任务数
+
+DAILY_ZIP_PATTERN = re.compile(r'^(\d{4})-(\d{2})-(\d{2})\.zip$')
+MONTH_ZIP_PATTERN = re.compile(r'^(\d{4})-(\d{2})_partial\.zip$')
+MONTH_GRIB_PATTERN = re.compile(r'^(\d{4})-(\d{2})\.grib$')
+
+
+# ----------------------
+# 文件稳定性检测
+# ----------------------
+class StableFileTracker:
+    """
+    记录每个文件最近一次看到的大小和修改时间，
+    只有在 stable_seconds 内没有任何变化的文件才会被交给后续处理
+
+    from_mtime=True 时首次看到的文件从其修改时间开始计时（单轮运行时没有上一轮的观察结果可比较），
+    修改时间距今不足 stable_seconds 的文件留到下一轮再处理。
+
+    Attributes:
+        stable_seconds (float): 文件需要保持不变的时长
+        seen (dict): 路径 -> (大小, 修改时间, 首次看到该状态的时间)
+        handled (set): 已经提交处理的路径，避免重复提交
+    """
+
+    def __init__(self, stable_seconds, from_mtime=False):
+        self.stable_seconds = stable_seconds
+        self.from_mtime = from_mtime
+        self.seen = {}
+        self.handled = set()
+
+    def poll(self, directories):
+        """扫描目录（只读取目录项元数据，不打开文件），返回本轮新变为稳定的文件"""
+        now = time.time()
+        stable = []
+        present = set()
+        for directory in directories:
+            if not os.path.isdir(directory):
+                continue
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if not entry.is_file():
+                        continue
+                    name = entry.name
+                    if not (DAILY_ZIP_PATTERN.match(name) or MONTH_ZIP_PATTERN.match(name)
+                            or MONTH_GRIB_PATTERN.match(name)):
+                        continue
+                    path = entry.path
+                    present.add(path)
+                    if path in self.handled:
+                        continue
+                    st = entry.stat()
+                    signature = (st.st_size, st.st_mtime)
+                    previous = self.seen.get(path)
+                    if previous is None and self.from_mtime:
+                        previous = self.seen[path] = (*signature, min(now, st.st_mtime))
+                    elif previous is None or previous[:2] != signature:
+                        previous = self.seen[path] = (*signature, now)
+                    if now - previous[2] >= self.stable_seconds:
+                        stable.append(path)
+
+        # 文件被删除或移走后清理记录，同名文件再次出现时会重新处理
+        for path in list(self.seen):
+            if path not in present:
+                del self.seen[path]
+        self.handled &= present
+        return sorted(stable)
+
+
+# ----------------------
+# 合并记录
+# ----------------------
+def load_state(path=state_file):
+    """读取旧版本的已合并日期记录"""
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {"merged_days": {}}
+
+
+def merge_record_path(month, merge_dir):
+    return os.path.join(merge_dir, f"{month}.grib_cache.json")
+
+
+def load_merge_record(month, merge_dir):
+    """
+    读取某月的合并记录 {"days": 已合并的日期, "size": 这些日期合并后 .grib_cache 的字节数}
+
+    没有记录时从旧版本的状态文件取已合并日期，并以当前 .grib_cache 的大小为准。
+    """
+    path = merge_record_path(month, merge_dir)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    cache_path = os.path.join(merge_dir, f"{month}.grib_cache")
+    return {
+        "days": load_state()["merged_days"].get(month, []),
+        "size": os.path.getsize(cache_path) if os.path.exists(cache_path) else 0,
+    }
+
+
+def save_merge_record(month, merge_dir, record):
+    """原子地写回合并记录"""
+    path = merge_record_path(month, merge_dir)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(record, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+# ----------------------
+# 子进程中执行的任务
+# ----------------------
+def append_grib(source_file, monthly_file):
+    """将 GRIB 文件中的所有消息追加到月文件（与 merge_days_to_month.merge_to_monthly 相同）"""
+    with open(source_file, 'rb') as sf, open(monthly_file, 'ab') as mf:
+        while True:
+            msg = eccodes.codes_grib_new_from_file(sf)
+            if not msg:
+                break
+            try:
+                eccodes.codes_write(msg, mf)
+            finally:
+                eccodes.codes_release(msg)
+
+
+def merge_daily_zips(month, zip_paths, merge_dir):
+    """
+    将同一月份的每日 ZIP 解压并追加到 {merge_dir}/{month}.grib_cache
+
+    每合并一天先写入该月的合并记录，再删除 ZIP：任何时刻中断，ZIP 要么仍在，要么已记入记录。
+    追加到一半中断时，.grib_cache 会比记录中的大小长，下次合并前先截掉这部分，避免重复的消息。
+
+    Returns:
+        List[int]: 该月全部已合并的日期
+    """
+    monthly_file = os.path.join(merge_dir, f"{month}.grib_cache")
+    record = load_merge_record(month, merge_dir)
+    if os.path.exists(monthly_file) and os.path.getsize(monthly_file) > record["size"]:
+        log_message(f"{os.path.basename(monthly_file)} 有未记录的追加内容，截断到 {record['size']} 字节")
+        with open(monthly_file, 'r+b') as f:
+            f.truncate(record["size"])
+
+    for zip_path in sorted(zip_paths):
+        date_str = os.path.basename(zip_path).split('.')[0]
+        day = int(date_str[-2:])
+        if day in record["days"]:
+            # 上次已记录但未来得及删除
+            os.remove(zip_path)
+            continue
+        temp_dir = os.path.join(merge_dir, f"temp_{date_str}")
+        try:
+            os.makedirs(temp_dir, exist_ok=True)
+            with zipfile.ZipFile(zip_path, 'r') as zf:
+                zf.extractall(temp_dir)
+            extracted = glob.glob(os.path.join(temp_dir, "*"))
+            if len(extracted) != 1:
+                log_message(f"{date_str}.zip 包含多个文件，跳过处理", level="ERROR")
+                continue
+            try:
+                append_grib(extracted[0], monthly_file)
+            except Exception:
+                # 撤销本次不完整的追加
+                if os.path.exists(monthly_file):
+                    with open(monthly_file, 'r+b') as f:
+                        f.truncate(record["size"])
+                raise
+            record = {"days": sorted(set(record["days"]) | {day}), "size": os.path.getsize(monthly_file)}
+            save_merge_record(month, merge_dir, record)
+            os.remove(zip_path)
+            log_message(f"已合并 {date_str} 到 {os.path.basename(monthly_file)}")
+        except Exception as e:
+            log_message(f"合并 {zip_path} 时发生错误: {str(e)}", level="ERROR")
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    return record["days"]
+
+
+def convert_month_grib(grib_path, output_dirs):
+    """将整月 GRIB 转换为风速 NetCDF（gen_dirs 的转换步骤），转换完成后原文件会被删除"""
+    selected_output_dir = select_output_directory(output_dirs)
+    if not selected_output_dir:
+        raise RuntimeError("所有输出目录空间不足")
+    calculate_wind_speed_with_pygrib(grib_path, selected_output_dir)
+
+
+def convert_month_zip(zip_path, output_dirs, cache_dir):
+    """解压整月的 _partial.zip 并转换，每个任务使用独立的缓存子目录，避免并发时 data.grib 冲突"""
+    job_cache = os.path.join(cache_dir, os.path.basename(zip_path).split("_partial.zip")[0])
+    os.makedirs(job_cache, exist_ok=True)
+    try:
+        new_grib = process_zip_file(zip_path, job_cache)
+        if not new_grib:
+            raise RuntimeError(f"解压失败: {zip_path}")
+        convert_month_grib(new_grib, output_dirs)
+        os.remove(zip_path)
+        log_message(f"已清理ZIP文件: {os.path.basename(zip_path)}")
+    finally:
+        shutil.rmtree(job_cache, ignore_errors=True)
+
+
+# ----------------------
+# 调度
+# ----------------------
+def finalize_month(month, merge_dir):
+    """月份所有日期合并完成后，将 .grib_cache 重命名为 .grib（rename.py 的步骤）"""
+    cache_path = os.path.join(merge_dir, f"{month}.grib_cache")
+    grib_path = os.path.join(merge_dir, f"{month}.grib")
+    os.replace(cache_path, grib_path)
+    record_path = merge_record_path(month, merge_dir)
+    if os.path.exists(record_path):
+        os.remove(record_path)
+    log_message(f"{month} 已合并完整，重命名为 {os.path.basename(grib_path)}")
+    return grib_path
+
+
+def watch(directories=None, merge_dir=merge_directory, output_dirs=None, cache_dir=cache_directory,
+          interval=poll_interval, stable=stable_seconds, workers=max_workers, run_once=False):
+    """
+    轮询下载目录，对新落地且已稳定的文件只运行受影响月份所需的合并/转换步骤
+
+    同一月份的任务串行执行，不同月份最多 workers 个任务并行。
+    run_once=True 时只处理当前已稳定的文件（修改时间距今超过 stable 秒），所有任务结束后返回，
+    尚未稳定的文件留给下一次运行；失败的文件在本轮内不再重试。
+
+    Returns:
+        run_once=True 时返回 {"failed": 处理失败的文件, "deferred": 尚未稳定、留到下次的文件}
+    """
+    directories = directories or watch_directories
+    output_dirs = output_dirs or output_directories
+    os.makedirs(merge_dir, exist_ok=True)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    tracker = StableFileTracker(stable, from_mtime=run_once)
+    pending = {}   # 月份 -> 待处理的 (类型, 路径) 列表
+    running = {}   # 月份 -> (future, 类型, 路径)
+    failed = set()
+
+    with stage_pool(max_workers=workers) as executor:
+        while True:
+            # 1. 收集新稳定的文件
+            for path in tracker.poll(directories + [merge_dir]):
+                tracker.handled.add(path)
+                name = os.path.basename(path)
+                match = DAILY_ZIP_PATTERN.match(name)
+                if match:
+                    month = f"{match.group(1)}-{match.group(2)}"
+                    pending.setdefault(month, []).append(("daily", path))
+                    continue
+                match = MONTH_ZIP_PATTERN.match(name) or MONTH_GRIB_PATTERN.match(name)
+                month = f"{match.group(1)}-{match.group(2)}"
+                kind = "month_zip" if name.endswith(".zip") else "month_grib"
+                pending.setdefault(month, []).append((kind, path))
+
+            # 2. 回收已完成的任务
+            for month, (future, kind, paths) in list(running.items()):
+                if not future.done():
+                    continue
+                del running[month]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    log_message(f"{month} 的任务失败: {str(e)}", level="ERROR")
+                    failed.update(paths)
+                    if not run_once:
+                        # 允许下一轮重新处理仍然存在的文件
+                        tracker.handled.difference_update(paths)
+                    continue
+                if kind == "daily":
+                    # 单日合并出错时只记录日志，ZIP 仍在；与任务失败同样处理
+                    leftover = [p for p in paths if os.path.exists(p)]
+                    failed.update(leftover)
+                    if not run_once:
+                        tracker.handled.difference_update(leftover)
+                    year, mon = map(int, month.split('-'))
+                    if len(result) == calendar.monthrange(year, mon)[1]:
+                        grib_path = finalize_month(month, merge_dir)
+                        tracker.handled.add(grib_path)
+                        pending.setdefault(month, []).append(("month_grib", grib_path))
+                else:
+                    log_message(f"{month} 转换完成")
+
+            # 3. 为空闲的月份提交任务
+            for month in sorted(pending):
+                if month in running or len(running) >= workers:
+                    continue
+                jobs = pending.pop(month)
+                merged_days = load_merge_record(month, merge_dir)["days"]
+                daily = []
+                for kind, p in jobs:
+                    if kind != "daily":
+                        continue
+                    if int(os.path.basename(p)[8:10]) in merged_days:
+                        # 已记入合并记录但上次未来得及删除的 ZIP
+                        os.remove(p)
+                        log_message(f"已清理已合并的ZIP文件: {os.path.basename(p)}")
+                    else:
+                        daily.append(p)
+                others = [(kind, p) for kind, p in jobs if kind != "daily"]
+                if daily:
+                    future = executor.submit(merge_daily_zips, month, daily, merge_dir)
+                    running[month] = (future, "daily", daily)
+                    if others:
+                        pending[month] = others
+                elif others:
+                    kind, path = others[0]
+                    if kind == "month_zip":
+                        future = executor.submit(convert_month_zip, path, output_dirs, cache_dir)
+                    else:
+                        future = executor.submit(convert_month_grib, path, output_dirs)
+                    running[month] = (future, kind, [path])
+                    if others[1:]:
+                        pending[month] = others[1:]
+
+            if run_once and not pending and not running:
+                deferred = sorted(p for p in tracker.seen if p not in tracker.handled)
+                return {"failed": sorted(failed), "deferred": deferred}
+            # 单轮运行时不等待轮询间隔，只短暂等待正在运行的任务
+            time.sleep(1 if run_once else interval)
+
+
+if __name__ == "__main__":
+    watch()
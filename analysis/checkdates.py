@@ -1,9 +1,13 @@
 import os
 import re
+import calendar
 import numpy as np
+import netCDF4 as nc
 from datetime import datetime, timedelta
 from typing import Tuple, List, Dict
 
+from wind_reader import backfill_summaries
+
 def generate_date_range(start_date, end_date):
     current_date = start_date
     while current_date <= end_date:
@@ -57,6 +61,67 @@ def analyze_files(directory) -> Tuple[List[str], List[Tuple[str, float, float]]]
     
     return missing_dates, []
 
+def validate_summaries(directory, max_speed=100.0) -> List[Tuple[str, int, str]]:
+    """
+    只读取转换时写入的逐时刻统计变量（每个文件几KB），精确定位有问题的时刻
+
+    返回 (文件名, 时间索引, 原因) 列表，时间索引为 -1 表示整个文件的问题
+    """
+    problems: List[Tuple[str, int, str]] = []
+    pattern = r'(\d{4})-(\d{2})_wind_speed\.nc'
+
+    for filename in sorted(os.listdir(directory)):
+        match = re.search(pattern, filename)
+        if not match:
+            continue
+        year, month = map(int, match.groups())
+        try:
+            with nc.Dataset(os.path.join(directory, filename), 'r') as ds:
+                if 'valid_count' not in ds.variables:
+                    problems.append((filename, -1, "无逐时刻统计信息"))
+                    continue
+                ds.set_auto_mask(False)
+                n_cells = len(ds.dimensions['lat']) * len(ds.dimensions['lon'])
+                valid_count = ds.variables['valid_count'][:]
+                fill_count = ds.variables['fill_count'][:]
+                ws_min = ds.variables['ws_min'][:]
+                ws_max = ds.variables['ws_max'][:]
+        except Exception as e:
+            problems.append((filename, -1, f"无法读取: {str(e)}"))
+            continue
+
+        expected_hours = calendar.monthrange(year, month)[1] * 24
+        if len(valid_count) != expected_hours:
+            problems.append((filename, -1, f"时刻数 {len(valid_count)}，应为 {expected_hours}"))
+
+        for t in range(len(valid_count)):
+            if valid_count[t] < 0:
+                problems.append((filename, t, "该时刻未记录统计信息"))
+            elif fill_count[t] > 0:
+                problems.append((filename, t, f"缺测格点 {fill_count[t]}/{n_cells}"))
+            elif valid_count[t] + fill_count[t] != n_cells:
+                problems.append((filename, t, f"格点数 {valid_count[t] + fill_count[t]}，应为 {n_cells}"))
+            elif not (0 <= ws_min[t] <= ws_max[t] <= max_speed):
+                problems.append((filename, t, f"风速范围异常 [{ws_min[t]:.2f}, {ws_max[t]:.2f}]"))
+
+    return problems
+
+def backfill_directory(directory) -> int:
+    """为目录中转换时没有记录逐时刻统计的文件补写统计变量（已完整的文件只读取统计变量后跳过）"""
+    total = 0
+    for filename in sorted(os.listdir(directory)):
+        if not re.search(r'(\d{4})-(\d{2})_wind_speed\.nc', filename):
+            continue
+        try:
+            n = backfill_summaries(os.path.join(directory, filename))
+        except Exception as e:
+            print(f"{filename} 补写统计信息失败: {str(e)}")
+            continue
+        if n:
+            print(f"{filename}: 补写 {n} 个时刻的统计信息")
+            total += n
+    return total
+
 def main():
     directory = r"G:\windspeed"
     
@@ -79,5 +144,14 @@ def main():
         for filename, size, deviation in anomalous_files:
             print(f"{filename}: {size:.2f}MB (偏离均值 {deviation:+.2f}%)")
 
+    # 旧文件转换时没有记录统计信息，先一次性补写（之后再运行时只会跳过）
+    backfill_directory(directory)
+    problems = validate_summaries(directory)
+    if problems:
+        print("\n逐时刻校验发现的问题：")
+        for filename, t, reason in problems:
+            where = "整个文件" if t < 0 else f"时刻 {t}"
+            print(f"{filename} {where}: {reason}")
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,103 @@
+import numpy as np
+import netCDF4 as nc
+
+from wind_reader import WindCube
+
+try:
+    import dask
+    import dask.array as da
+except ImportError:  # dask 为可选依赖，只有选择 dask 后端时才需要
+    dask = None
+
+try:
+    from dask.distributed import Client, LocalCluster
+except ImportError:
+    Client = LocalCluster = None
+
+
+def require_dask():
+    if dask is None:
+        raise ImportError("dask 后端需要安装 dask（pip install \"dask[distributed]\"）")
+
+
+# ----------------------
+# 惰性风速数组
+# ----------------------
+def read_point_block(path, lat_idx, lon_idx, start, stop):
+    """读取单个文件 [start, stop) 时刻的像元序列（在调度器的工作进程中运行）"""
+    with WindCube(path) as cube:
+        return cube.read_points(lat_idx, lon_idx, ranges=[(start, stop)])
+
+
+def open_point_archive(files, lat_idx, lon_idx, block_size=168, var_name="wind_speed"):
+    """
+    把多个月份文件中指定像元的序列拼接成一个惰性的 (time × 像元) dask 数组
+
+    每个分块是一次 read_point_block 任务，只在计算时才读取；打开时只读取各文件的时刻数。
+
+    Returns:
+        (u10, bounds): 惰性数组，以及每个文件在时间轴上的 [start, stop)
+    """
+    require_dask()
+    n_points = len(lat_idx)
+    lat_idx = dask.delayed(np.asarray(lat_idx), pure=True)
+    lon_idx = dask.delayed(np.asarray(lon_idx), pure=True)
+    read = dask.delayed(read_point_block, pure=True)
+
+    parts, bounds, offset = [], [], 0
+    for path in files:
+        with nc.Dataset(path, "r") as ds:
+            n_time = ds.variables[var_name].shape[0]
+        for start in range(0, n_time, block_size):
+            stop = min(start + block_size, n_time)
+            parts.append(da.from_delayed(read(str(path), lat_idx, lon_idx, start, stop),
+                                         shape=(stop - start, n_points), dtype=np.float32))
+        bounds.append((offset, offset + n_time))
+        offset += n_time
+    return da.concatenate(parts, axis=0), bounds
+
+
+# ----------------------
+# 统计
+# ----------------------
+def monthly_band_hours(u10, bounds, coefficients, low=5, high=20):
+    """
+    构建逐月有效小时数的任务图：按时间广播各月的 (高度 × 像元) 修正系数，阈值判断后按月求和
+
+    Args:
+        u10: open_point_archive 返回的惰性数组
+        bounds: 每个月在时间轴上的 [start, stop)
+        coefficients: 每个月 (高度 × 像元) 的修正系数列表
+
+    Returns:
+        dask.array: (月份 × 高度 × 像元) 的有效小时数（尚未计算）
+    """
+    coeff_time = da.concatenate([
+        da.broadcast_to(da.from_array(coeff[:, None, :]), (coeff.shape[0], stop - start, coeff.shape[1]))
+        for (start, stop), coeff in zip(bounds, coefficients)
+    ], axis=1)
+    u = u10[None, :, :] * coeff_time
+    valid = (u >= low) & (u <= high)
+    return da.stack([valid[:, start:stop].sum(axis=1) for start, stop in bounds])
+
+
+def compute_band_hours(files, lat_idx, lon_idx, coefficients, n_workers=None, memory_limit="4GB",
+                       block_size=168):
+    """
+    在本地多进程调度器上计算各月份各高度的有效小时数
+
+    每个工作进程的内存不超过 memory_limit，超出时调度器会暂停读取新的分块，
+    因此无论处理多少个月份，内存占用都保持在固定预算内。
+
+    Returns:
+        np.ndarray: (月份 × 高度 × 像元) int64
+    """
+    require_dask()
+    u10, bounds = open_point_archive(files, lat_idx, lon_idx, block_size)
+    hours = monthly_band_hours(u10, bounds, coefficients)
+    if LocalCluster is None:
+        print("警告: 未安装 dask.distributed，使用线程调度器（无内存上限）")
+        return hours.compute(scheduler="threads", num_workers=n_workers)
+    with LocalCluster(n_workers=n_workers, threads_per_worker=1, memory_limit=memory_limit,
+                      processes=True) as cluster, Client(cluster) as client:
+        return client.compute(hours).result()
@@ -0,0 +1,49 @@
+import os
+import json
+import hashlib
+import numpy as np
+from pathlib import Path
+
+# ----------------------
+# 输入指纹
+# ----------------------
+def file_signature(path, content=False):
+    """
+    文件签名：路径、大小和修改时间；content=True 时改用内容的 SHA-1
+    （文件被复制或移动到其他盘、修改时间变化但内容相同时仍然命中缓存）
+    """
+    path = Path(path)
+    if not path.exists():
+        return [path.name, None]
+    if content:
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return [path.name, digest.hexdigest()]
+    st = os.stat(path)
+    return [str(path), st.st_size, st.st_mtime_ns]
+
+
+def fingerprint(*parts):
+    """
+    计算任意输入组合的指纹（SHA-1 十六进制字符串）
+
+    numpy 数组按 dtype、形状和原始字节计入，其余对象按 JSON（键排序）计入，
+    因此参数、网格坐标和文件签名可以混合传入。
+    """
+    digest = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            array = np.ascontiguousarray(part)
+            digest.update(f"{array.dtype.str}{array.shape}".encode())
+            digest.update(array.tobytes())
+        else:
+            digest.update(json.dumps(part, sort_keys=True, default=str).encode())
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+
+def files_fingerprint(paths, *extra, content=False):
+    """一组文件（按排序后的顺序）加上额外参数的指纹"""
+    return fingerprint([file_signature(p, content) for p in sorted(map(str, paths))], *extra)
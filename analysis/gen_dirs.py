@@ -9,6 +9,9 @@ import shutil
 from tqdm import tqdm
 import logging
 
+from wind_reader import (TIME_UNITS, TIME_CALENDAR, LEGACY_TIME_UNITS, encode_times, upgrade_legacy_time,
+                         ensure_summary_variables, summarize_timestep, update_file_summary)
+
 # 配置日志记录
 logging.basicConfig(
     filename="processing.log",
@@ -117,6 +120,7 @@ def process_zip_file(zip_path, cache_dir):
 
 def calculate_wind_speed_with_pygrib(input_file, output_dir):
     """处理单个GRIB文件，自动识别各个月份数据，跳过缺失日期，为每个月份生成单独NetCDF文件"""
+    grbs = None
     try:
         log_message(f"开始处理文件: {input_file}")
         grbs = pygrib.open(input_file)
@@ -132,6 +136,7 @@ def calculate_wind_speed_with_pygrib(input_file, output_dir):
                 messages_by_month[(year, month)].append({
                     'date': data_date,
                     'step': grb.endStep,
+                    'valid_time': grb.validDate,
                     'name': grb.name,
                     'message': grb.messagenumber
                 })
@@ -164,7 +169,10 @@ def calculate_wind_speed_with_pygrib(input_file, output_dir):
                 ds = nc.Dataset(output_path, "a")  # 打开现有文件
                 time_var = ds.variables["time"]
                 ws_var = ds.variables["wind_speed"]
-                existing_dates = set(time_var[:])
+                if getattr(time_var, "units", "") == LEGACY_TIME_UNITS:
+                    upgrade_legacy_time(time_var)
+                    log_message(f"已将旧的YYYYMMDD时间转换为逐小时时间: {os.path.basename(output_path)}")
+                existing_times = set(time_var[:].tolist())
             else:
                 ds = nc.Dataset(output_path, "w")  # 创建新文件
                 ds.createDimension("time", None)
@@ -175,18 +183,23 @@ def calculate_wind_speed_with_pygrib(input_file, output_dir):
                 lon_var = ds.createVariable("lon", "f4", ("lon",))
                 ws_var = ds.createVariable("wind_speed", "f4", ("time", "lat", "lon"),
                                            zlib=True, fill_value=-9999.0)
-                time_var.units = "YYYYMMDD"
+                time_var.units = TIME_UNITS
+                time_var.calendar = TIME_CALENDAR
+                time_var.standard_name = "time"
                 lat_var.units = "degrees_north"
                 lon_var.units = "degrees_east"
                 ws_var.units = "m/s"
                 ws_var.long_name = "10m wind speed"
                 lat_var[:] = lats[:, 0]
                 lon_var[:] = lons[0, :]
-                existing_dates = set()
-            # 追加数据
-            for t_idx, (date, step) in enumerate(valid_steps):
-                if date in existing_dates:
-                    log_message(f"跳过已存在的日期: {date}")
+                existing_times = set()
+            summary_vars = ensure_summary_variables(ds)
+            # 追加数据（按逐小时的有效时间去重，新记录写在文件末尾）
+            n_times = len(time_var)
+            for date, step in valid_steps:
+                valid_time = int(encode_times([time_steps[(date, step)]['u']['valid_time']])[0])
+                if valid_time in existing_times:
+                    log_message(f"跳过已存在的时刻: {date} +{step}h")
                     continue
                 u_msg = grbs.message(time_steps[(date, step)]['u']['message'])
                 v_msg = grbs.message(time_steps[(date, step)]['v']['message'])
@@ -197,21 +210,29 @@ def calculate_wind_speed_with_pygrib(input_file, output_dir):
                 v_data[~valid_mask] = 0
                 ws = np.sqrt(u_data ** 2 + v_data ** 2)
                 ws[~valid_mask] = -9999.0
-                ws_var[len(existing_dates) + t_idx, :, :] = ws
-                time_var[len(existing_dates) + t_idx] = date
+                ws_var[n_times, :, :] = ws
+                time_var[n_times] = valid_time
+                # 写入时顺便记录逐时刻统计，校验时无需再读取整幅网格
+                for name, value in summarize_timestep(ws, valid_mask).items():
+                    summary_vars[name][n_times] = value
+                existing_times.add(valid_time)
+                n_times += 1
+            update_file_summary(ds)
             ds.close()
             log_message(f"完成保存: {os.path.basename(output_path)}")
+        grbs.close()
+        grbs = None
+        log_message("关闭GRIB文件句柄")
+        # 所有月份都写入 NetCDF 后才删除原文件；转换失败时保留，下次可以重新处理
+        os.remove(input_file)
+        log_message(f"已删除原文件: {os.path.basename(input_file)}")
     except Exception as e:
         log_message(f"处理出错: {str(e)}", level="ERROR")
         raise
     finally:
-        if "grbs" in locals():
+        if grbs is not None:
             grbs.close()
             log_message("关闭GRIB文件句柄")
-        # 处理完成后删除原文件
-        if os.path.exists(input_file):
-            os.remove(input_file)
-            log_message(f"已删除原文件: {os.path.basename(input_file)}")
 
 def process_directory(input_dir, output_directories, cache_dir):
     """处理单个目录的核心逻辑"""
@@ -264,9 +285,10 @@ output_directories = [
 cache_directory = r"E:\temp"
 
 # 执行处理流程
-for input_dir in input_directories:
-    if os.path.isdir(input_dir):
-        log_message(f"开始处理主目录: {input_dir}")
-        process_directory(input_dir, output_directories, cache_directory)
-    else:
-        log_message(f"目录不存在: {input_dir}", level="ERROR")
\ No newline at end of file
+if __name__ == "__main__":
+    for input_dir in input_directories:
+        if os.path.isdir(input_dir):
+            log_message(f"开始处理主目录: {input_dir}")
+            process_directory(input_dir, output_directories, cache_directory)
+        else:
+            log_message(f"目录不存在: {input_dir}", level="ERROR")
\ No newline at end of file
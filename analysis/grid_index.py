@@ -0,0 +1,221 @@
+import os
+import hashlib
+import numpy as np
+from scipy.spatial import cKDTree
+
+from fingerprint import fingerprint
+
+
+# ----------------------
+# 网格描述
+# ----------------------
+def _regular_axis(axis, tolerance):
+    """等间距坐标轴返回 (起点, 步长)，否则返回 None（升序或降序均可）"""
+    axis = np.asarray(axis, dtype=np.float64)
+    if len(axis) < 2:
+        return None
+    step = (axis[-1] - axis[0]) / (len(axis) - 1)
+    if step == 0:
+        return None
+    deviation = np.abs(axis - (axis[0] + step * np.arange(len(axis))))
+    if deviation.max() > tolerance * abs(step):
+        return None
+    return float(axis[0]), float(step)
+
+
+def _nearest_on_axis(axis, x, value, period=None, wrap=False):
+    """
+    等间距轴上的最近格点：x 为 value 的小数索引，在 floor(x) 与其下一个格点中按实际坐标距离取较近者，
+    距离相等时取较小的索引（与逐点 np.abs(axis - value).argmin() 一致，不用 np.rint 的四舍六入五成双）
+
+    period 不为 None 时按该周期计算距离；wrap=True 时索引首尾环绕，否则截断到轴的范围内。
+    """
+    n = len(axis)
+    lo = np.floor(x).astype(np.int64)
+    if wrap:
+        lo %= n
+        hi = (lo + 1) % n
+    else:
+        lo = np.clip(lo, 0, n - 2)
+        hi = lo + 1
+    d_lo, d_hi = axis[lo] - value, axis[hi] - value
+    if period is not None:
+        d_lo = np.mod(d_lo + period / 2, period) - period / 2
+        d_hi = np.mod(d_hi + period / 2, period) - period / 2
+    d_lo, d_hi = np.abs(d_lo), np.abs(d_hi)
+    # 环绕时接缝处 lo 为最后一列、hi 为第一列，相等时同样取较小的索引
+    return np.where(d_hi < d_lo, hi, np.where(d_hi > d_lo, lo, np.minimum(lo, hi)))
+
+
+def _unit_vectors(lat, lon):
+    lat, lon = np.radians(lat), np.radians(lon)
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+class GridDescriptor:
+    """
+    经纬度网格的最近点查找
+
+    等间距网格（纬度可升序或降序，经度可为 0~360 或 -180~180，全球网格首尾相接）
+    直接按坐标换算索引，每个点 O(1)，所有点一次向量化完成；
+    不等间距网格退回到单位球面向量的 KD 树（弦长与球面距离单调对应，即按 haversine 距离取最近点）。
+
+    Attributes:
+        lat, lon (np.ndarray): 网格坐标
+        regular (bool): 是否为等间距网格
+        periodic (bool): 经度是否覆盖全球（查找时跨 0/360 或 ±180 经线环绕）
+    """
+
+    def __init__(self, lat, lon, tolerance=0.01):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.shape = (len(self.lat), len(self.lon))
+        lat_axis = _regular_axis(self.lat, tolerance)
+        lon_axis = _regular_axis(self.lon, tolerance)
+        self.regular = lat_axis is not None and lon_axis is not None
+        self._tree = None
+        if self.regular:
+            (self.lat0, self.dlat), (self.lon0, self.dlon) = lat_axis, lon_axis
+            span = len(self.lon) * abs(self.dlon)
+            # 首尾不重复（n × 步长 = 360）或首尾重复（-180 与 180 同为格点）都视为全球网格
+            self.periodic = abs(span - 360) <= tolerance * abs(self.dlon) \
+                or abs(span - abs(self.dlon) - 360) <= tolerance * abs(self.dlon)
+        else:
+            self.periodic = True
+
+    @classmethod
+    def from_dataset(cls, ds, **kwargs):
+        """从含 lat/lon 坐标的 xarray.Dataset 构建"""
+        return cls(ds.lat.values, ds.lon.values, **kwargs)
+
+    def _nearest_regular(self, lat, lon):
+        lat_idx = _nearest_on_axis(self.lat, (lat - self.lat0) / self.dlat, lat)
+        # 经度先换算为相对起点沿步长方向的偏移，再按周期环绕
+        offset = (lon - self.lon0) * np.sign(self.dlon)
+        if self.periodic:
+            lon_idx = _nearest_on_axis(self.lon, np.mod(offset, 360) / abs(self.dlon), lon, period=360, wrap=True)
+            # 首尾重复的网格（-180 与 180 同为格点）统一取第一列
+            lon_idx = np.where(lon_idx * abs(self.dlon) > 360 - abs(self.dlon) / 2, 0, lon_idx)
+        else:
+            offset = np.mod(offset + 180, 360) - 180
+            lon_idx = _nearest_on_axis(self.lon, offset / abs(self.dlon), lon, period=360)
+        return lat_idx, lon_idx
+
+    def _nearest_tree(self, lat, lon):
+        if self._tree is None:
+            lon_grid, lat_grid = np.meshgrid(self.lon, self.lat)
+            self._tree = cKDTree(_unit_vectors(lat_grid.ravel(), lon_grid.ravel()))
+        _, indices = self._tree.query(_unit_vectors(lat, lon))
+        return (indices // self.shape[1]).astype(np.int64), (indices % self.shape[1]).astype(np.int64)
+
+    def nearest(self, lat, lon):
+        """
+        Args:
+            lat, lon: 查询点坐标（经度任意范围）
+
+        Returns:
+            (lat_idx, lon_idx): int64 索引，坐标为 NaN 的点为 -1
+        """
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        lat_idx = np.full(lat.shape, -1, dtype=np.int64)
+        lon_idx = np.full(lat.shape, -1, dtype=np.int64)
+        ok = ~(np.isnan(lat) | np.isnan(lon))
+        finder = self._nearest_regular if self.regular else self._nearest_tree
+        lat_idx[ok], lon_idx[ok] = finder(lat[ok], lon[ok])
+        return lat_idx, lon_idx
+
+
+# ----------------------
+# 风电场索引缓存
+# ----------------------
+FARM_INDEX_CACHE = 'farm_index_cache.npz'
+
+
+def farm_index_cache_path(output_dir):
+    """各脚本共用的索引缓存文件（ver1/ver2/ver3 都写在输出目录下的同一个文件中）"""
+    return os.path.join(str(output_dir), FARM_INDEX_CACHE)
+
+
+def farm_table_tag(farm_file):
+    """风电场表的标识：文件名加完整路径的短哈希，同名但位置不同的表也不会互相覆盖"""
+    path = os.path.abspath(str(farm_file))
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return f"{stem}-{hashlib.sha1(path.encode('utf-8')).hexdigest()[:8]}"
+
+
+class FarmIndexCache:
+    """
+    各网格（风速、粗糙度、温度等）上风电场最近格点索引的二进制缓存，所有网格保存在同一个 npz 中
+
+    每个网格按 "网格名称:风电场表标识" 保存一组 (指纹, 纬度索引, 经度索引)，指纹由网格坐标和风电场坐标
+    （经度统一到 [0, 360)）共同决定，任一方变化时该网格重新计算；未变化时直接返回内存中的数组。
+    不同脚本使用不同的风电场表时条目互不覆盖，写回时保留文件中其他脚本的条目。
+
+    Attributes:
+        path: 缓存文件路径
+        tag (str): 风电场表标识，见 farm_table_tag
+        entries (dict): 条目名称 -> (指纹, lat_idx, lon_idx)
+    """
+
+    def __init__(self, path, farm_file=None):
+        self.path = str(path)
+        self.tag = farm_table_tag(farm_file) if farm_file is not None else None
+        self.entries = self._read()
+        self.updated = set()
+
+    def _read(self):
+        entries = {}
+        if os.path.exists(self.path):
+            try:
+                with np.load(self.path) as data:
+                    for name in data.files:
+                        if name.endswith('__key'):
+                            entry = name[:-len('__key')]
+                            entries[entry] = (str(data[name]), data[f'{entry}__lat'], data[f'{entry}__lon'])
+            except Exception as e:
+                print(f"索引缓存 {self.path} 无法读取，将重新计算: {str(e)}")
+                return {}
+        return entries
+
+    def _entry(self, family):
+        return family if self.tag is None else f"{family}:{self.tag}"
+
+    def nearest(self, family, grid_lat, grid_lon, lats, lons):
+        """
+        Args:
+            family: 网格名称，如 'wind'、'z0'、'temperature'
+            grid_lat, grid_lon: 网格坐标
+            lats, lons: 风电场坐标（经度任意范围）
+
+        Returns:
+            (lat_idx, lon_idx): 同 GridDescriptor.nearest
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.mod(np.asarray(lons, dtype=np.float64), 360)
+        key = fingerprint(np.asarray(grid_lat, dtype=np.float64), np.asarray(grid_lon, dtype=np.float64), lats, lons)
+        entry = self._entry(family)
+        cached = self.entries.get(entry)
+        if cached is not None and cached[0] == key:
+            return cached[1], cached[2]
+        lat_idx, lon_idx = GridDescriptor(grid_lat, grid_lon).nearest(lats, lons)
+        self.entries[entry] = (key, lat_idx, lon_idx)
+        self.updated.add(entry)
+        return lat_idx, lon_idx
+
+    def save(self):
+        """有更新时写回缓存文件：先合并文件中其他脚本的条目，再写临时文件并替换"""
+        if not self.updated:
+            return
+        entries = self._read()
+        entries.update({entry: self.entries[entry] for entry in self.updated})
+        arrays = {}
+        for entry, (key, lat_idx, lon_idx) in entries.items():
+            arrays[f'{entry}__key'] = np.array(key)
+            arrays[f'{entry}__lat'] = lat_idx
+            arrays[f'{entry}__lon'] = lon_idx
+        tmp_path = self.path + '.tmp.npz'
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, self.path)
+        self.entries = entries
+        self.updated = set()
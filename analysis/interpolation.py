@@ -0,0 +1,90 @@
+import numpy as np
+from scipy import sparse
+
+# ----------------------
+# 插值权重
+# ----------------------
+def _bracket(axis, values, period=None):
+    """
+    返回每个值两侧的格点索引 (i0, i1) 及 i1 的线性权重 t（坐标轴可升序或降序，等间距或不等间距）
+
+    period 不为 None 时按周期坐标处理，最后一个格点与第一个格点之间也可插值。
+    """
+    axis = np.asarray(axis, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    order = np.argsort(axis, kind='stable')
+    sorted_axis = axis[order]
+    n = len(axis)
+    if period is not None:
+        values = np.mod(values - sorted_axis[0], period) + sorted_axis[0]
+        extended = np.append(sorted_axis, sorted_axis[0] + period)
+        k = np.clip(np.searchsorted(extended, values, side='right') - 1, 0, n - 1)
+        t = (values - extended[k]) / (extended[k + 1] - extended[k])
+        return order[k], order[(k + 1) % n], t
+    k = np.clip(np.searchsorted(sorted_axis, values, side='right') - 1, 0, n - 2)
+    t = np.clip((values - sorted_axis[k]) / (sorted_axis[k + 1] - sorted_axis[k]), 0.0, 1.0)
+    return order[k], order[k + 1], t
+
+
+def _corner_weights(lat, lon, points_lat, points_lon, method, power):
+    """每个点四个角格点的 (行, 列, 权重)，均为 (点 × 4) 数组"""
+    i0, i1, ty = _bracket(lat, points_lat)
+    j0, j1, tx = _bracket(lon, points_lon, period=360)
+    rows = np.stack([i0, i0, i1, i1], axis=1)
+    cols = np.stack([j0, j1, j0, j1], axis=1)
+    if method == "bilinear":
+        weights = np.stack([(1 - ty) * (1 - tx), (1 - ty) * tx, ty * (1 - tx), ty * tx], axis=1)
+    elif method == "idw":
+        # 以格距为单位的平面距离，落在格点上时该格点权重为 1
+        dy = np.stack([ty, ty, 1 - ty, 1 - ty], axis=1)
+        dx = np.stack([tx, 1 - tx, tx, 1 - tx], axis=1)
+        distance = np.hypot(dy, dx)
+        with np.errstate(divide='ignore'):
+            weights = 1.0 / distance ** power
+        exact = distance == 0
+        weights[exact.any(axis=1)] = exact[exact.any(axis=1)]
+        weights /= weights.sum(axis=1, keepdims=True)
+    else:
+        raise ValueError(f"未知的插值方法: {method}")
+    return rows, cols, weights
+
+
+class PointInterpolator:
+    """
+    点插值的稀疏权重矩阵 (点 × 用到的格点)
+
+    只保留至少一个点用到的格点，读取时只需提取这些格点的序列（可复用按块读取），
+    之后每个时间块做一次稀疏矩阵乘法即可得到所有点的插值结果。
+    任一参与插值的格点缺测时结果为 NaN。
+
+    Attributes:
+        cell_lat, cell_lon (np.ndarray): 用到的格点的网格索引
+        matrix (scipy.sparse.csr_matrix): (点 × 格点) 权重，每行之和为 1
+    """
+
+    def __init__(self, lat, lon, points_lat, points_lon, method="bilinear", power=2):
+        rows, cols, weights = _corner_weights(lat, lon, points_lat, points_lon, method, power)
+        keep = weights > 0
+        # 没有正权重的角点不参与计算，避免其缺测值影响结果
+        flat = (rows * len(lon) + cols)[keep]
+        cells, column = np.unique(flat, return_inverse=True)
+        self.cell_lat = cells // len(lon)
+        self.cell_lon = cells % len(lon)
+        point = np.broadcast_to(np.arange(len(points_lat))[:, None], keep.shape)[keep]
+        self.matrix = sparse.csr_matrix((weights[keep], (point, column.ravel())),
+                                        shape=(len(points_lat), len(cells)))
+        self.method = method
+
+    @property
+    def n_points(self):
+        return self.matrix.shape[0]
+
+    def apply(self, cells):
+        """
+        Args:
+            cells: (time × 格点) 的风速
+
+        Returns:
+            np.ndarray: (time × 点) float64
+        """
+        return np.asarray(self.matrix @ cells.T.astype(np.float64)).T
@@ -0,0 +1,214 @@
+import glob
+import json
+import time
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from fingerprint import files_fingerprint
+
+
+# ----------------------
+# 阶段定义
+# ----------------------
+class Stage:
+    """
+    流程中的一个阶段
+
+    Attributes:
+        name (str): 阶段名称
+        func (callable): 无参数的执行函数
+        inputs (list): 输入文件路径或通配符；也可以是返回路径列表的函数（执行前才求值）
+        outputs (list): 输出文件路径或通配符，任何一项不存在时阶段都需要重新运行
+        deps (list): 依赖的阶段名称，依赖阶段的输出自动计入本阶段的输入
+        params (dict): 影响结果的参数，变化时重新运行
+        always (bool): 每次都运行，不按指纹跳过（输入指纹无法反映全部待处理工作的阶段，如数据接收）
+    """
+
+    def __init__(self, name, func, inputs=(), outputs=(), deps=(), params=None, always=False):
+        self.name = name
+        self.func = func
+        self.inputs = inputs
+        self.outputs = list(outputs)
+        self.deps = list(deps)
+        self.params = params or {}
+        self.always = always
+
+    def __repr__(self):
+        return f"Stage({self.name!r}, deps={self.deps})"
+
+
+class StageIncomplete(RuntimeError):
+    """
+    阶段函数处理完能处理的部分后抛出，表示有月份失败或文件被推迟
+
+    已写出的输出仍可供下游使用，但不记录本阶段的指纹，下次运行时重新处理。
+    """
+
+
+def expand_paths(patterns):
+    """展开路径和通配符，返回存在的文件列表"""
+    if callable(patterns):
+        patterns = patterns()
+    paths = []
+    for pattern in patterns:
+        pattern = str(pattern)
+        if glob.has_magic(pattern):
+            paths.extend(glob.glob(pattern))
+        elif Path(pattern).is_dir():
+            paths.extend(str(p) for p in Path(pattern).iterdir() if p.is_file())
+        elif Path(pattern).exists():
+            paths.append(pattern)
+    return sorted(set(paths))
+
+
+def outputs_exist(stage):
+    return all(expand_paths([pattern]) for pattern in stage.outputs)
+
+
+def stage_pool(max_workers=None):
+    """
+    阶段内部使用的进程池，子进程以 spawn 方式启动
+
+    流程在线程中同时运行多个阶段，fork 可能恰好发生在另一线程持有 netCDF/HDF5 全局锁的时刻，
+    子进程继承到已被占用的锁后会永久阻塞；spawn 的子进程重新导入模块，不继承任何锁。
+    """
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+# ----------------------
+# 调度
+# ----------------------
+class Pipeline:
+    """
+    按依赖关系运行各阶段：输入（含上游输出）和参数的指纹与上次成功运行时相同且输出齐全的阶段直接跳过，
+    互不依赖的阶段在线程池中同时运行（各阶段内部仍可使用自己的进程池）
+
+    Attributes:
+        stages (dict): 名称 -> Stage
+        state_file (Path): 记录各阶段上次成功运行时指纹的 JSON 文件
+    """
+
+    def __init__(self, stages, state_file):
+        self.stages = {stage.name: stage for stage in stages}
+        self.state_file = Path(state_file)
+        for stage in stages:
+            for dep in stage.deps:
+                if dep not in self.stages:
+                    raise ValueError(f"阶段 {stage.name} 依赖未定义的阶段 {dep}")
+
+    def load_state(self):
+        if self.state_file.exists():
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {}
+
+    def save_state(self, state):
+        tmp_path = self.state_file.with_name(self.state_file.name + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        tmp_path.replace(self.state_file)
+
+    def fingerprint(self, stage):
+        """本阶段输入文件、上游阶段输出文件和参数的指纹"""
+        paths = expand_paths(stage.inputs)
+        for dep in stage.deps:
+            paths += expand_paths(self.stages[dep].outputs)
+        return files_fingerprint(paths, stage.params)
+
+    def required(self, targets=None):
+        """目标阶段及其全部上游阶段"""
+        if targets is None:
+            return set(self.stages)
+        needed, stack = set(), list(targets)
+        while stack:
+            name = stack.pop()
+            if name not in needed:
+                needed.add(name)
+                stack.extend(self.stages[name].deps)
+        return needed
+
+    def _start(self, stage, state, force, executor, running, run_stage):
+        """检查阶段是否需要运行，需要时提交到线程池；返回 'skipped' / 'failed' / None（已提交）"""
+        name = stage.name
+        try:
+            fingerprint = self.fingerprint(stage)
+        except Exception as e:
+            print(f"[{name}] 无法计算输入指纹: {str(e)}")
+            return 'failed'
+        if not stage.always and name not in force and state.get(name) == fingerprint and outputs_exist(stage):
+            print(f"[{name}] 输入未变化，跳过")
+            return 'skipped'
+        print(f"[{name}] 开始运行")
+        running[executor.submit(run_stage, stage)] = (name, fingerprint)
+        return None
+
+    def run(self, targets=None, force=(), max_workers=None):
+        """
+        运行流程
+
+        Args:
+            targets: 只运行这些阶段（及其上游），None 表示全部
+            force: 无论指纹是否变化都重新运行的阶段
+            max_workers: 同时运行的阶段数
+
+        Returns:
+            dict: 阶段名称 -> 'skipped' / 'done' / 'incomplete' / 'failed' / 'blocked'
+            （'incomplete' 的阶段不记录指纹，但下游照常运行）
+        """
+        state = self.load_state()
+        pending = self.required(targets)
+        status = {}
+        running = {}
+
+        def run_stage(stage):
+            start = time.time()
+            stage.func()
+            return time.time() - start
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while pending or running:
+                # 提交依赖都已完成的阶段；跳过的阶段会让下游立即可以调度，因此反复扫描直到没有变化
+                changed = True
+                while changed:
+                    changed = False
+                    for name in sorted(pending):
+                        stage = self.stages[name]
+                        dep_status = [status.get(dep) for dep in stage.deps]
+                        if any(s in ('failed', 'blocked') for s in dep_status):
+                            print(f"[{name}] 上游阶段失败，跳过")
+                            status[name] = 'blocked'
+                        elif not all(s in ('skipped', 'done', 'incomplete') for s in dep_status):
+                            continue
+                        else:
+                            status[name] = self._start(stage, state, force, executor, running, run_stage)
+                        pending.discard(name)
+                        changed = True
+
+                if not running:
+                    if pending:
+                        # 剩余阶段的依赖不在本次运行范围内时会走到这里
+                        raise RuntimeError(f"无法调度的阶段: {sorted(pending)}")
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, fingerprint = running.pop(future)
+                    try:
+                        elapsed = future.result()
+                    except StageIncomplete as e:
+                        print(f"[{name}] 部分完成，下次重新运行: {str(e)}")
+                        if state.pop(name, None) is not None:
+                            self.save_state(state)
+                        status[name] = 'incomplete'
+                        continue
+                    except Exception as e:
+                        print(f"[{name}] 运行失败: {str(e)}")
+                        status[name] = 'failed'
+                        continue
+                    # 记录运行前计算的指纹：运行期间输入再有变化时，下次仍会重新运行
+                    state[name] = fingerprint
+                    self.save_state(state)
+                    status[name] = 'done'
+                    print(f"[{name}] 完成，用时 {elapsed:.1f} 秒")
+        return status
@@ -0,0 +1,188 @@
+import numpy as np
+import pandas as pd
+
+# ----------------------
+# 功率曲线
+# ----------------------
+class PowerCurve:
+    """
+    表格化的风机功率曲线，功率以额定功率的比例表示（0~1）
+
+    风速低于第一个节点时出力为 0，节点之间线性插值，最后一个节点到切出风速之间保持最后一个节点的出力，
+    达到切出风速后出力为 0。
+
+    Attributes:
+        name (str): 曲线名称，用作输出列名的一部分
+        speeds (np.ndarray): 风速节点（m/s，严格递增）
+        power (np.ndarray): 各节点的出力比例
+        cut_out (float): 切出风速
+    """
+
+    def __init__(self, name, speeds, power, cut_out=25.0):
+        self.name = name
+        self.speeds = np.asarray(speeds, dtype=np.float64)
+        self.power = np.asarray(power, dtype=np.float64)
+        self.cut_out = float(cut_out)
+        if self.speeds.shape != self.power.shape or np.any(np.diff(self.speeds) <= 0):
+            raise ValueError(f"功率曲线 {name} 的风速节点必须严格递增且与出力一一对应")
+
+    def __call__(self, u):
+        """逐点计算出力比例，NaN 保持为 NaN"""
+        u = np.asarray(u, dtype=np.float64)
+        p = np.interp(u, self.speeds, self.power, left=0.0)
+        p[u >= self.cut_out] = 0.0
+        return p
+
+    def __repr__(self):
+        return f"PowerCurve({self.name!r}, 切出 {self.cut_out} m/s)"
+
+
+def load_power_curve(path, name=None, cut_out=25.0):
+    """
+    从 CSV 读取功率曲线（列: speed, power），power 可以是比例或 kW，
+    最大值大于 1 时按最大值归一化
+    """
+    table = pd.read_csv(path)
+    power = table['power'].values.astype(np.float64)
+    if power.max() > 1:
+        power = power / power.max()
+    return PowerCurve(name or str(path).rsplit('.', 1)[0].replace('\\', '/').split('/')[-1],
+                      table['speed'].values, power, cut_out=cut_out)
+
+
+# 通用的 IEC 风区等级曲线（按额定功率归一化），用于没有具体机型资料时的估算
+POWER_CURVES = {
+    "IEC_I": PowerCurve(
+        "IEC_I",
+        [3.5, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13],
+        [0.0, 0.02, 0.06, 0.12, 0.21, 0.32, 0.46, 0.62, 0.78, 0.91, 1.0],
+    ),
+    "IEC_II": PowerCurve(
+        "IEC_II",
+        [3, 4, 5, 6, 7, 8, 9, 10, 11, 12],
+        [0.0, 0.04, 0.09, 0.17, 0.28, 0.42, 0.59, 0.77, 0.92, 1.0],
+    ),
+    "IEC_III": PowerCurve(
+        "IEC_III",
+        [3, 4, 5, 6, 7, 8, 9, 10, 11],
+        [0.0, 0.05, 0.12, 0.22, 0.36, 0.54, 0.74, 0.92, 1.0],
+    ),
+}
+
+
+def resolve_curves(curves):
+    """曲线名称（POWER_CURVES 中的键）、CSV 路径或 PowerCurve 对象统一转换为 PowerCurve 列表"""
+    resolved = []
+    for curve in curves:
+        if isinstance(curve, PowerCurve):
+            resolved.append(curve)
+        elif curve in POWER_CURVES:
+            resolved.append(POWER_CURVES[curve])
+        else:
+            resolved.append(load_power_curve(curve))
+    return resolved
+
+
+# ----------------------
+# 批量计算
+# ----------------------
+class CurveSet:
+    """
+    多条功率曲线共用一张查找表
+
+    每个风速只计算一次所在的分格和插值权重，之后每条曲线只需一次查表，
+    因此增加曲线不会增加风速读取量，也不会重复进行插值查找。
+    曲线节点是 step 的整数倍时结果与 np.interp 一致。
+
+    Attributes:
+        curves (list): PowerCurve 列表
+        step (float): 查找表分辨率（m/s）
+        tables (np.ndarray): (曲线 × 分格) 的出力比例表
+    """
+
+    def __init__(self, curves, step=0.01):
+        self.curves = resolve_curves(curves)
+        self.names = [curve.name for curve in self.curves]
+        self.step = step
+        self.cut_out = np.array([curve.cut_out for curve in self.curves])
+        # 查找表不含切出，切出在查表后单独处理，避免切出处的跳变被线性插值抹平
+        n = int(np.ceil(self.cut_out.max() / step)) + 1
+        grid = np.arange(n + 1) * step
+        self.tables = np.stack([
+            np.interp(grid, curve.speeds, curve.power, left=0.0) for curve in self.curves
+        ])
+
+    def _lookup(self, u):
+        """计算共用的分格索引、插值权重和有效掩码"""
+        valid = ~np.isnan(u)
+        pos = np.where(valid, u, 0.0) / self.step
+        np.clip(pos, 0, self.tables.shape[1] - 1, out=pos)
+        idx = np.minimum(pos.astype(np.intp), self.tables.shape[1] - 2)
+        frac = pos - idx
+        return idx, frac, valid
+
+    def _evaluate(self, k, idx, frac, u, valid):
+        table = self.tables[k]
+        low = table[idx]
+        p = low + frac * (table[idx + 1] - low)
+        p[(u >= self.cut_out[k]) | ~valid] = 0.0
+        return p
+
+    def hourly(self, u):
+        """
+        逐小时出力比例
+
+        Args:
+            u: (time × 像元) 轮毂高度风速
+
+        Returns:
+            np.ndarray: (曲线 × time × 像元)，风速缺测的时刻为 NaN；乘以装机容量即为逐小时发电量（MWh）
+        """
+        idx, frac, valid = self._lookup(u)
+        result = np.empty((len(self.curves),) + u.shape)
+        for k in range(len(self.curves)):
+            result[k] = self._evaluate(k, idx, frac, u, valid)
+            result[k][~valid] = np.nan
+        return result
+
+    def full_load_hours(self, u):
+        """
+        按时间汇总的满发小时数
+
+        Returns:
+            (full_load_hours, data_hours): (曲线 × 像元) 的出力比例之和，以及 (像元,) 的有效风速小时数；
+            容量系数 = full_load_hours / data_hours，发电量 = full_load_hours × 装机容量
+        """
+        idx, frac, valid = self._lookup(u)
+        flh = np.stack([
+            self._evaluate(k, idx, frac, u, valid).sum(axis=0) for k in range(len(self.curves))
+        ])
+        return flh, valid.sum(axis=0)
+
+
+def annual_capacity_factor(month_df, names):
+    """
+    由逐月的满发小时数汇总年度发电量和容量系数
+
+    Args:
+        month_df: 包含 year, lat, lon, capacity, data_hours 以及 flh_{曲线名} 列的逐月风电场表
+        names: 曲线名称列表
+
+    Returns:
+        pd.DataFrame: year, lat, lon, capacity_mw，以及每条曲线的 energy_{曲线名}_mwh 和 cf_{曲线名}；
+        同一坐标的多个风电场合并计算（与 annual_valid_hours.csv 的分组一致）
+    """
+    df = pd.DataFrame({
+        'year': month_df['year'],
+        'lat': month_df['lat'],
+        'lon': month_df['lon'],
+        'capacity_hours': month_df['capacity'] * month_df['data_hours'],
+    })
+    for name in names:
+        df[f'energy_{name}_mwh'] = month_df[f'flh_{name}'] * month_df['capacity']
+    annual = df.groupby(['year', 'lat', 'lon']).sum().reset_index()
+    for name in names:
+        annual[f'cf_{name}'] = annual[f'energy_{name}_mwh'] / annual['capacity_hours']
+    capacity = month_df.groupby(['year', 'lat', 'lon', 'month'])['capacity'].sum().groupby(['year', 'lat', 'lon']).max()
+    annual.insert(3, 'capacity_mw', capacity.values)
+    return annual.drop(columns='capacity_hours')
@@ -0,0 +1,140 @@
+import numpy as np
+from pathlib import Path
+
+# ----------------------
+# 对数分桶分位数草图（DDSketch）
+# ----------------------
+class QuantileSketch:
+    """
+    所有像元共用一组对数分桶的分位数草图，按 (像元 × 分桶) 计数存储
+
+    分桶 i 覆盖 (γ^(k-1), γ^k]，γ = (1 + α) / (1 - α)，返回值的相对误差不超过 α；
+    小于 min_value 的风速计入第 0 个分桶（按 0 返回），大于 max_value 的计入最后一个分桶。
+    计数直接相加即可合并，因此可以按月份分块更新、跨进程合并，保存后继续追加新月份。
+
+    Attributes:
+        counts (np.ndarray): (像元 × 分桶) 的 uint32 计数
+        months (list): 已计入的月份（'YYYY-MM'）
+        keys (np.ndarray): 像元标识（如唯一像元的网格索引），加载时用于核对像元是否一致
+        source (str): 决定风速序列的其余输入（轮毂高度、粗糙度等）的指纹，加载时同样核对
+    """
+
+    def __init__(self, n_pixel, alpha=0.01, min_value=0.05, max_value=100.0, keys=None, source=""):
+        self.alpha = alpha
+        self.min_value = min_value
+        self.max_value = max_value
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = np.log(self.gamma)
+        self.k_min = int(np.ceil(np.log(min_value) / self._log_gamma))
+        k_max = int(np.ceil(np.log(max_value) / self._log_gamma))
+        self.n_bins = k_max - self.k_min + 2
+        self.counts = np.zeros((n_pixel, self.n_bins), dtype=np.uint32)
+        self.months = []
+        self.keys = keys
+        self.source = source
+
+    def bucket_counts(self, u):
+        """将 (time × 像元) 风速转换为 (像元 × 分桶) 计数，NaN 不计入；结果可直接传给 merge"""
+        n_time, n_pixel = u.shape
+        valid = ~np.isnan(u)
+        values = u[valid]
+        pixel = np.broadcast_to(np.arange(n_pixel), u.shape)[valid]
+        with np.errstate(divide='ignore'):
+            k = np.ceil(np.log(np.maximum(values, self.min_value)) / self._log_gamma).astype(np.int64)
+        bins = np.where(values < self.min_value, 0, np.clip(k - self.k_min + 1, 1, self.n_bins - 1))
+        counts = np.bincount(pixel * self.n_bins + bins, minlength=n_pixel * self.n_bins)
+        return counts.reshape(n_pixel, self.n_bins).astype(np.uint16 if n_time < 65536 else np.uint32)
+
+    def merge(self, counts, pixels=None, month=None):
+        """
+        合并分桶计数
+
+        Args:
+            counts: bucket_counts 的结果或另一个草图的 counts
+            pixels: counts 各行对应的像元（布尔掩码或索引），None 表示全部像元
+            month: 计入的月份，记录后可用 has_month 判断是否已处理
+        """
+        if pixels is None:
+            self.counts += counts
+        else:
+            self.counts[pixels] += counts
+        if month is not None:
+            self.months.append(month)
+
+    def add(self, u, pixels=None, month=None):
+        self.merge(self.bucket_counts(u), pixels, month)
+
+    def has_month(self, month):
+        return month in self.months
+
+    def bucket_values(self):
+        """各分桶的代表值 2γ^k / (γ + 1)"""
+        k = np.arange(self.n_bins - 1) + self.k_min
+        return np.concatenate([[0.0], 2 * self.gamma ** k / (self.gamma + 1)])
+
+    def quantile(self, q):
+        """
+        计算各像元的分位数
+
+        Args:
+            q: 分位数（0~1），标量或列表
+
+        Returns:
+            np.ndarray: (像元 × len(q))，没有样本的像元为 NaN
+        """
+        q = np.atleast_1d(q)
+        cumulative = np.cumsum(self.counts, axis=1, dtype=np.int64)
+        total = cumulative[:, -1]
+        values = self.bucket_values()
+        result = np.full((len(self.counts), len(q)), np.nan)
+        has_data = total > 0
+        for j, quantile in enumerate(q):
+            rank = quantile * (total[has_data] - 1)
+            index = (cumulative[has_data] <= rank[:, None]).sum(axis=1)
+            result[has_data, j] = values[index]
+        return result
+
+    def total(self):
+        return self.counts.sum(axis=1, dtype=np.int64)
+
+    # ----------------------
+    # 存取
+    # ----------------------
+    def save(self, path):
+        """保存为 npz（先写临时文件再替换，中断时不会损坏已有草图）"""
+        path = Path(path)
+        tmp_path = path.with_name(path.name + ".tmp.npz")
+        np.savez_compressed(
+            tmp_path,
+            counts=self.counts,
+            months=np.array(self.months, dtype=str),
+            keys=self.keys if self.keys is not None else np.empty(0),
+            params=np.array([self.alpha, self.min_value, self.max_value]),
+            source=np.array(self.source),
+        )
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            alpha, min_value, max_value = data['params']
+            keys = data['keys'] if data['keys'].size else None
+            source = str(data['source']) if 'source' in data.files else ""
+            sketch = cls(len(data['counts']), alpha, min_value, max_value, keys=keys, source=source)
+            sketch.counts = data['counts']
+            sketch.months = data['months'].tolist()
+        return sketch
+
+    @classmethod
+    def load_or_create(cls, path, keys, source="", **kwargs):
+        """读取已有草图；文件不存在、像元与 keys 不一致或输入指纹 source 不同时新建"""
+        path = Path(path)
+        if path.exists():
+            sketch = cls.load(path)
+            if sketch.keys is None or not np.array_equal(sketch.keys, keys):
+                print(f"警告: {path.name} 的像元与当前风电场不一致，重新建立分位数草图")
+            elif sketch.source != source:
+                print(f"警告: {path.name} 的轮毂高度或粗糙度输入已变化，重新建立分位数草图")
+            else:
+                return sketch
+        return cls(len(keys), keys=keys, source=source, **kwargs)
@@ -0,0 +1,163 @@
+import numpy as np
+import netCDF4 as nc
+import xarray as xr
+from pathlib import Path
+from tqdm import tqdm
+from functools import partial
+
+from wind_reader import read_grid_coords, normalize_lon
+from wind_maps import nearest_index
+from fingerprint import files_fingerprint
+from pipeline import stage_pool
+
+# ----------------------
+# 配置参数
+# ----------------------
+wind_dir = Path(r"G:/windspeed")
+roughness_dir = Path(r"G:/monthly aerodynamic roughness length dataset")
+output_dir = Path(r"E:\PythonProjiects\Data_of_energy_competition\output")
+Z0_VAR = 'Monthly_z0m_25km'
+
+
+# ----------------------
+# 重映射
+# ----------------------
+class Z0Regridder:
+    """
+    把 25 km 粗糙度网格重映射到 ERA5 0.25° 风速网格
+
+    method="area": 每个 z0 格点归入中心最近的 ERA5 格点，ERA5 格点取落入其中的有效 z0 的平均值
+        （两套网格分辨率相近，各格点面积在格内视为相等）；没有 z0 格点落入的 ERA5 格点使用最近格点的值。
+    method="nearest": 直接取最近 z0 格点。
+    两种方法在最近格点无效时，都会在 search_radius 个 z0 格点范围内取最近的有效值（海岸附近的风电场）。
+
+    Attributes:
+        wind_lat, wind_lon (np.ndarray): 目标网格
+        lat_map, lon_map (np.ndarray): 每个 ERA5 行/列最近的 z0 行/列
+    """
+
+    def __init__(self, z0_lat, z0_lon, wind_lat, wind_lon, method="area", search_radius=1):
+        if method not in ("area", "nearest"):
+            raise ValueError(f"未知的重映射方法: {method}")
+        self.method = method
+        self.search_radius = search_radius
+        self.wind_lat = np.asarray(wind_lat)
+        self.wind_lon = normalize_lon(np.asarray(wind_lon))
+        self.shape = (len(self.wind_lat), len(self.wind_lon))
+        self.lat_map = nearest_index(z0_lat, self.wind_lat)
+        self.lon_map = nearest_index(z0_lon, self.wind_lon, period=360)
+        # 每个 z0 格点所属的 ERA5 格点（展平索引），用于按面积平均
+        rows = nearest_index(self.wind_lat, z0_lat)
+        cols = nearest_index(self.wind_lon, normalize_lon(z0_lon), period=360)
+        self.target = (rows[:, None] * self.shape[1] + cols[None, :]).ravel()
+
+    def _nearest(self, z0):
+        return z0[np.ix_(self.lat_map, self.lon_map)]
+
+    def _fill_from_neighbours(self, z0, result):
+        """最近格点无效的 ERA5 格点，在 z0 网格上按距离由近到远搜索有效值"""
+        r = self.search_radius
+        if r <= 0:
+            return result
+        missing = np.isnan(result)
+        offsets = sorted(((di, dj) for di in range(-r, r + 1) for dj in range(-r, r + 1) if di or dj),
+                         key=lambda o: o[0] ** 2 + o[1] ** 2)
+        for di, dj in offsets:
+            if not missing.any():
+                break
+            rows = np.clip(self.lat_map + di, 0, z0.shape[0] - 1)
+            cols = (self.lon_map + dj) % z0.shape[1]
+            candidate = z0[np.ix_(rows, cols)]
+            fill = missing & ~np.isnan(candidate)
+            result[fill] = candidate[fill]
+            missing &= ~fill
+        return result
+
+    def regrid(self, z0):
+        """
+        Args:
+            z0: z0 网格上的粗糙度（非正值或 NaN 视为无效）
+
+        Returns:
+            np.ndarray: ERA5 网格上的 float32 粗糙度，无效处为 NaN
+        """
+        z0 = np.where(z0 > 0, z0, np.nan).astype(np.float64)
+        nearest = self._nearest(z0)
+        if self.method == "area":
+            values = z0.ravel()
+            valid = ~np.isnan(values)
+            size = self.shape[0] * self.shape[1]
+            total = np.bincount(self.target[valid], weights=values[valid], minlength=size)
+            count = np.bincount(self.target[valid], minlength=size)
+            covered = np.bincount(self.target, minlength=size) > 0
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = (total / count).reshape(self.shape)
+            result = np.where(covered.reshape(self.shape), mean, nearest)
+        else:
+            result = nearest.copy()
+        return self._fill_from_neighbours(z0, result).astype(np.float32)
+
+
+def regrid_fingerprint(src, regridder):
+    """源文件、重映射方法和目标网格的指纹，保存在输出文件的 input_fingerprint 属性中"""
+    return files_fingerprint([src], regridder.method, regridder.search_radius,
+                             regridder.wind_lat.astype(np.float64), regridder.wind_lon.astype(np.float64))
+
+
+def stored_fingerprint(path):
+    """已有输出文件记录的指纹，文件不存在或无法读取时返回 None"""
+    try:
+        with nc.Dataset(path) as ds:
+            return getattr(ds, "input_fingerprint", None)
+    except (OSError, RuntimeError):
+        return None
+
+
+def regrid_file(src, dst, regridder):
+    """
+    重映射单个粗糙度文件并保存（坐标与风速文件一致，可直接使用风速像元索引）
+
+    指纹属性最后写入，写到一半中断的文件没有指纹，下次会重新生成。
+    """
+    with xr.open_dataset(src) as ds:
+        z0 = ds[Z0_VAR].values
+    with nc.Dataset(dst, "w") as out:
+        out.createDimension("lat", regridder.shape[0])
+        out.createDimension("lon", regridder.shape[1])
+        out.createVariable("lat", "f4", ("lat",))[:] = regridder.wind_lat
+        out.createVariable("lon", "f4", ("lon",))[:] = regridder.wind_lon
+        var = out.createVariable(Z0_VAR, "f4", ("lat", "lon"), zlib=True, complevel=5, fill_value=np.nan)
+        var[:] = regridder.regrid(np.squeeze(z0))
+        out.regrid_method = regridder.method
+        out.source_file = Path(src).name
+        out.input_fingerprint = regrid_fingerprint(src, regridder)
+    return dst
+
+
+def regrid_directory(src_dir, dst_dir, wind_file, pattern="*.nc", method="area", max_workers=None):
+    """
+    把 src_dir 中匹配 pattern 的粗糙度文件重映射到 dst_dir（同名文件），
+    目标文件记录的指纹（源文件、方法、目标网格）与当前相同时跳过；各文件在进程池中并行处理
+    """
+    src_dir, dst_dir = Path(src_dir), Path(dst_dir)
+    dst_dir.mkdir(parents=True, exist_ok=True)
+    files = sorted(src_dir.glob(pattern))
+    if not files:
+        return
+    wind_lat, wind_lon = read_grid_coords(wind_file)
+    with xr.open_dataset(files[0]) as ds:
+        regridder = Z0Regridder(ds.lat.values, ds.lon.values, wind_lat, wind_lon, method)
+    todo = [f for f in files if stored_fingerprint(dst_dir / f.name) != regrid_fingerprint(f, regridder)]
+    if not todo:
+        return
+    with stage_pool(max_workers=max_workers) as executor:
+        destinations = [dst_dir / f.name for f in todo]
+        list(tqdm(executor.map(partial(regrid_file, regridder=regridder), todo, destinations),
+                  total=len(todo), desc=f"重映射 {src_dir.name}"))
+
+
+if __name__ == "__main__":
+    sample_wind = next(wind_dir.glob("*.nc"))
+    # 逐月粗糙度和多年月平均粗糙度都重映射到风速网格
+    regrid_directory(roughness_dir, output_dir / "z0_era5", sample_wind)
+    regrid_directory(output_dir / "monthly_average_z0", output_dir / "z0_era5" / "monthly_average", sample_wind)
@@ -5,6 +5,9 @@ import netCDF4 as nc
 from datetime import datetime
 from collections import defaultdict
 
+from wind_reader import (TIME_UNITS, TIME_CALENDAR, encode_times, ensure_summary_variables, summarize_timestep,
+                         update_file_summary)
+
 
 def calculate_wind_speed_with_pygrib(input_file, output_dir):
     """
@@ -29,6 +32,7 @@ def calculate_wind_speed_with_pygrib(input_file, output_dir):
                 messages_by_month[(year, month)].append({
                     'date': data_date,
                     'step': grb.endStep,
+                    'valid_time': grb.validDate,
                     'name': grb.name,
                     'message': grb.messagenumber
                 })
@@ -88,7 +92,9 @@ def calculate_wind_speed_with_pygrib(input_file, output_dir):
                 print(f"成功创建NetCDF文件变量: time, lat, lon, wind_speed")
 
                 # 设置属性
-                time_var.units = 'YYYYMMDD'
+                time_var.units = TIME_UNITS
+                time_var.calendar = TIME_CALENDAR
+                time_var.standard_name = 'time'
                 lat_var.units = 'degrees_north'
                 lon_var.units = 'degrees_east'
                 ws_var.units = 'm/s'
@@ -100,6 +106,9 @@ def calculate_wind_speed_with_pygrib(input_file, output_dir):
                 lon_var[:] = lons[0, :]
                 print(f"成功写入纬度和经度坐标数据")
 
+                # 逐时刻统计变量（与 gen_dirs 的转换结果一致，可用 checkdates 校验）
+                summary_vars = ensure_summary_variables(ds)
+
                 # 逐时间步处理
                 for t_idx, (date, step) in enumerate(valid_steps):
                     print(f"正在处理时间步: 日期={date}, 步长={step}")
@@ -123,14 +132,20 @@ def calculate_wind_speed_with_pygrib(input_file, output_dir):
                     ws_var[t_idx, :, :] = ws
                     print(f"成功计算并写入风速数据: 日期={date}, 步长={step}")
 
-                    # 记录时间
-                    time_var[t_idx] = date
-                    print(f"成功记录时间: 日期={date}, 索引={t_idx}")
+                    # 记录逐时刻统计
+                    for name, value in summarize_timestep(ws, valid_mask).items():
+                        summary_vars[name][t_idx] = value
+
+                    # 记录逐小时的有效时间
+                    valid_time = time_steps[(date, step)]['u']['valid_time']
+                    time_var[t_idx] = encode_times([valid_time])[0]
+                    print(f"成功记录时间: 时刻={valid_time}, 索引={t_idx}")
 
                     # 清理内存
                     del u_data, v_data, ws
                     print(f"成功清理内存: 时间步索引={t_idx}")
 
+                update_file_summary(ds)
                 print(f"已保存: {output_path}")
 
     except Exception as e:
@@ -0,0 +1,36 @@
+import numpy as np
+
+from grid_index import GridDescriptor
+
+
+def brute_nearest(lat_axis, lon_axis, lat, lon):
+    """逐点 argmin（经度按环绕距离），距离相等时取较小的索引"""
+    lat_idx = np.array([np.abs(lat_axis - v).argmin() for v in lat])
+    lon_idx = np.array([np.abs(np.mod(lon_axis - v + 180, 360) - 180).argmin() for v in lon])
+    return lat_idx, lon_idx
+
+
+def test_ties_match_argmin():
+    lat_axis, lon_axis = np.linspace(90, -90, 721), np.arange(1440) * 0.25
+    grid = GridDescriptor(lat_axis, lon_axis)
+    lat = (lat_axis[:-1] + lat_axis[1:]) / 2
+    lon = np.resize((lon_axis[:-1] + lon_axis[1:]) / 2, len(lat))
+    expected = brute_nearest(lat_axis, lon_axis, lat, lon)
+    result = grid.nearest(lat, lon)
+    np.testing.assert_array_equal(result[0], expected[0])
+    np.testing.assert_array_equal(result[1], expected[1])
+    assert grid.nearest([10.125], [0.0])[0][0] == 319
+
+
+def test_seam_tie_takes_first_column():
+    lon_axis = np.arange(1440) * 0.25
+    grid = GridDescriptor(np.linspace(90, -90, 721), lon_axis)
+    _, lon_idx = grid.nearest([0.0, 0.0, 0.0], [-0.125, 359.875, 719.875])
+    np.testing.assert_array_equal(lon_idx, [0, 0, 0])
+    assert np.abs(np.mod(lon_axis + 0.125 + 180, 360) - 180).argmin() == 0
+
+
+def test_duplicated_seam_maps_to_first_column():
+    grid = GridDescriptor(np.linspace(-90, 90, 721), np.linspace(-180, 180, 1441))
+    _, lon_idx = grid.nearest([0.0, 0.0, 0.0], [180.0, -180.0, 179.9])
+    np.testing.assert_array_equal(lon_idx, [0, 0, 0])
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+from scipy.special import gammaln, digamma
+
+# ----------------------
+# 充分统计量
+# ----------------------
+def weibull_sums(u):
+    """
+    计算 (time × 像元) 风速块的充分统计量，NaN 不计入
+
+    不同时间块或不同月份的结果直接相加即可合并，不需要保留完整序列。
+
+    Returns:
+        (n, s1, s2): 各像元的有效样本数、Σu、Σu²
+    """
+    valid = ~np.isnan(u)
+    u0 = np.where(valid, u, 0.0)
+    return valid.sum(axis=0), u0.sum(axis=0), np.square(u0).sum(axis=0)
+
+
+# ----------------------
+# 参数估计
+# ----------------------
+def fit_weibull(n, s1, s2, iterations=20, tol=1e-10):
+    """
+    矩估计 Weibull 形状参数 k 和尺度参数 c（对所有像元同时计算）
+
+    由 Γ(1+2/k) / Γ(1+1/k)² = 1 + CV² 用向量化牛顿迭代求 k，
+    初值取 Justus 近似 k = CV^-1.086，再由 c = 均值 / Γ(1+1/k) 得到尺度参数。
+    样本数少于 2 或方差为 0 的像元返回 NaN。
+
+    Returns:
+        (k, c): 与输入同形状的数组
+    """
+    n = np.asarray(n, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = s1 / n
+        var = s2 / n - mean ** 2
+        cv = np.sqrt(var) / mean
+    ok = (n >= 2) & (var > 0) & (mean > 0)
+    cv = np.where(ok, cv, 1.0)
+
+    target = np.log1p(cv ** 2)
+    k = np.clip(cv ** -1.086, 0.1, 50.0)
+    for _ in range(iterations):
+        a, b = 1 + 2 / k, 1 + 1 / k
+        f = gammaln(a) - 2 * gammaln(b) - target
+        df = (2 / k ** 2) * (digamma(b) - digamma(a))
+        step = f / df
+        k = np.clip(k - step, 0.1, 50.0)
+        if np.all(np.abs(step) < tol * k):
+            break
+
+    c = np.where(ok, mean / np.exp(gammaln(1 + 1 / k)), np.nan)
+    k = np.where(ok, k, np.nan)
+    return k, c
+
+
+def weibull_table(month_df):
+    """
+    由逐月风电场表（year, month, lat, lon, data_hours, speed_sum, speed_sumsq）生成参数表
+
+    Returns:
+        pd.DataFrame: year, month, lat, lon, mean_speed, weibull_k, weibull_c；同一坐标只保留一行
+    """
+    df = month_df.drop_duplicates(['year', 'month', 'lat', 'lon'])
+    n, s1, s2 = df['data_hours'].values, df['speed_sum'].values, df['speed_sumsq'].values
+    k, c = fit_weibull(n, s1, s2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_speed = s1 / n
+    return pd.DataFrame({
+        'year': df['year'].values,
+        'month': df['month'].values,
+        'lat': df['lat'].values,
+        'lon': df['lon'].values,
+        'mean_speed': mean_speed,
+        'weibull_k': k,
+        'weibull_c': c,
+    })
@@ -1,10 +1,11 @@
 import os
 import numpy as np
-import netCDF4 as nc
 import pandas as pd
 from datetime import datetime
-from tqdm import tqdm
-from scipy.spatial import cKDTree
+from concurrent.futures import ProcessPoolExecutor
+
+from wind_reader import WindCube, normalize_lon, read_grid_coords, unique_pixels
+from grid_index import GridDescriptor, FarmIndexCache, farm_index_cache_path
 
 def check_data_completeness(nc_dir):
     """
@@ -67,69 +68,55 @@ def load_wind_power_locations(file_path):
 
     return df[['Latitude', 'Longitude']]
 
-def find_nearest_grid_points_vectorized(lats, lons, nc_lats, nc_lons):
-    """使用KD树批量查找最接近的网格点索引"""
-    lon_grid, lat_grid = np.meshgrid(nc_lons, nc_lats)
-    grid_points = np.column_stack((lat_grid.ravel(), lon_grid.ravel()))
-
-    tree = cKDTree(grid_points)
-    query_points = np.column_stack((lats, lons))
-
-    distances, indices = tree.query(query_points)
-
-    lat_indices = indices // len(nc_lons)
-    lon_indices = indices % len(nc_lons)
-
-    return lat_indices, lon_indices
-
-def process_yearly_data(year, nc_files, nc_dir, power_plant_locations):
-    """处理某一年的所有数据文件"""
-    total_valid_hours = np.zeros(len(power_plant_locations))
+def find_nearest_grid_points_vectorized(lats, lons, nc_lats, nc_lons, index_cache=None, family='wind'):
+    """按网格坐标直接换算最近网格点索引（经度跨 0/360 经线环绕）；指定 index_cache 时网格和坐标未变化直接取缓存"""
+    if index_cache is not None:
+        return index_cache.nearest(family, nc_lats, nc_lons, lats, lons)
+    return GridDescriptor(nc_lats, nc_lons).nearest(lats, lons)
+
+def count_valid_hours(file_path, lat_indices, lon_indices, batch_size=50):
+    """统计单个月份文件中各风机的有效小时数（在子进程中运行），返回 (有效小时数, 总小时数)"""
+    valid_hours = np.zeros(len(lat_indices), dtype=np.int64)
+    with WindCube(file_path) as cube:
+        for _, _, location_wind_speeds in cube.iter_point_blocks(lat_indices, lon_indices, batch_size):
+            # 高度修正（缺测值为NaN，不计入有效小时）
+            Z1, Z2, Z0 = 10.0, 109.0, 0.03
+            location_wind_speeds = location_wind_speeds * (np.log(Z2/Z0) / np.log(Z1/Z0))
+
+            valid_mask = (location_wind_speeds >= 3) & (location_wind_speeds <= 25)
+            valid_hours += np.sum(valid_mask, axis=0)
+        return valid_hours, cube.n_time
+
+def submit_yearly_data(nc_files, nc_dir, power_plant_locations, executor, index_cache=None):
+    """用第一个文件计算网格点索引，把该年的月份文件提交到进程池，返回 ([(文件名, future)], inverse)"""
+    nc_files = sorted(nc_files)
+    lats, lons = read_grid_coords(os.path.join(nc_dir, nc_files[0]))
+    # 风电场经度统一到0-360，与网格一致
+    lat_indices, lon_indices = find_nearest_grid_points_vectorized(
+        power_plant_locations['Latitude'].values,
+        normalize_lon(power_plant_locations['Longitude'].values),
+        lats, lons, index_cache
+    )
+    # 多个风机落在同一网格时只计算一次
+    (lat_indices, lon_indices), _, inverse = unique_pixels(lat_indices, lon_indices)
+    with WindCube(os.path.join(nc_dir, nc_files[0])) as cube:
+        print(f'读取计划: {cube.plan(lat_indices, lon_indices).summary()}')
+    submitted = [(nc_file, executor.submit(count_valid_hours, os.path.join(nc_dir, nc_file), lat_indices, lon_indices))
+                 for nc_file in nc_files]
+    return submitted, inverse
+
+def collect_yearly_data(year, submission, power_plant_locations):
+    """按文件名顺序归约各月份的部分结果（按唯一网格），最后广播回各风机"""
+    submitted, inverse = submission
+    total_valid_hours = np.zeros(inverse.max() + 1, dtype=np.int64)
     total_hours = 0
-    first_file = True
-    lat_indices = None
-    lon_indices = None
-
-    for nc_file in sorted(nc_files):
-        file_path = os.path.join(nc_dir, nc_file)
-        print(f'\n处理文件: {nc_file}')
-
-        with nc.Dataset(file_path, 'r') as ds:
-            if first_file:
-                # 第一个文件时计算网格点索引
-                lats = ds.variables['lat'][:]
-                lons = ds.variables['lon'][:]
-                lat_indices, lon_indices = find_nearest_grid_points_vectorized(
-                    power_plant_locations['Latitude'].values,
-                    power_plant_locations['Longitude'].values,
-                    lats, lons
-                )
-                first_file = False
-
-            times = ds.variables['time'][:]
-            total_hours += len(times)
-
-            # 批量处理时间点
-            batch_size = 50
-            total_batches = (len(times) + batch_size - 1) // batch_size
-
-            for batch_idx in tqdm(range(total_batches), desc=f'处理{nc_file}'):
-                start_idx = batch_idx * batch_size
-                end_idx = min((batch_idx + 1) * batch_size, len(times))
-
-                wind_speeds = ds.variables['wind_speed'][start_idx:end_idx, :, :]
-
-                # 高度修正
-                Z1, Z2, Z0 = 10.0, 109.0, 0.03
-                wind_speeds = wind_speeds * (np.log(Z2/Z0) / np.log(Z1/Z0))
-
-                for idx in range(len(power_plant_locations)):
-                    location_wind_speeds = wind_speeds[:, lat_indices[idx], lon_indices[idx]]
-                    if hasattr(location_wind_speeds, 'mask'):
-                        location_wind_speeds = location_wind_speeds.filled(-9999)
-
-                    valid_mask = (location_wind_speeds >= 3) & (location_wind_speeds <= 25) & (location_wind_speeds != -9999)
-                    total_valid_hours[idx] += float(np.sum(valid_mask))
+
+    for nc_file, future in submitted:
+        valid_hours, n_hours = future.result()
+        print(f'\n已处理文件: {nc_file}')
+        total_valid_hours += valid_hours
+        total_hours += n_hours
+    total_valid_hours = total_valid_hours[inverse].astype(np.float64)
 
     # 创建年度结果DataFrame
     results_df = pd.DataFrame({
@@ -146,6 +133,12 @@ def process_yearly_data(year, nc_files, nc_dir, power_plant_locations):
 
     return results_df
 
+def process_yearly_data(year, nc_files, nc_dir, power_plant_locations, max_workers=None, index_cache=None):
+    """处理某一年的所有数据文件，各月份文件在进程池中并行处理"""
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        submission = submit_yearly_data(nc_files, nc_dir, power_plant_locations, executor, index_cache)
+        return collect_yearly_data(year, submission, power_plant_locations)
+
 def main():
     # 设置路径
     nc_dir = r'G:\windspeed'  # 风速数据目录
@@ -169,26 +162,33 @@ def main():
     power_plants = load_wind_power_locations(wind_power_csv)
     print(f'成功加载 {len(power_plants)} 个风机位置')
 
-    # 处理每年数据
+    # 风电场网格索引缓存：网格和风电场坐标不变时各年份直接复用
+    index_cache = FarmIndexCache(farm_index_cache_path(output_dir), wind_power_csv)
+
+    # 处理每年数据：所有年份的月份文件一次性提交到同一个进程池，再按年份顺序汇总
     yearly_stats = []
-    for year, files in sorted(files_by_year.items()):
-        print(f'\n处理 {year} 年数据...')
-        year_results = process_yearly_data(year, files, nc_dir, power_plants)
-
-        # 保存年度详细数据
-        detail_file = os.path.join(output_dir, f'wind_turbine_stats_{year}.csv')
-        year_results.to_csv(detail_file, index=False)
-        print(f'{year}年详细数据已保存至: {detail_file}')
-
-        # 记录年度统计
-        mean_ratio = year_results['valid_ratio'].mean()
-        yearly_stats.append({
-            'year': year,
-            'average_valid_ratio': mean_ratio,
-            'total_turbines': len(year_results),
-            'total_hours': year_results['total_hours'].iloc[0]
-        })
-        print(f'{year}年平均有效率: {mean_ratio:.2%}')
+    with ProcessPoolExecutor() as executor:
+        submissions = {year: submit_yearly_data(files, nc_dir, power_plants, executor, index_cache)
+                             for year, files in sorted(files_by_year.items())}
+        index_cache.save()
+        for year, submission in submissions.items():
+            print(f'\n处理 {year} 年数据...')
+            year_results = collect_yearly_data(year, submission, power_plants)
+
+            # 保存年度详细数据
+            detail_file = os.path.join(output_dir, f'wind_turbine_stats_{year}.csv')
+            year_results.to_csv(detail_file, index=False)
+            print(f'{year}年详细数据已保存至: {detail_file}')
+
+            # 记录年度统计
+            mean_ratio = year_results['valid_ratio'].mean()
+            yearly_stats.append({
+                'year': year,
+                'average_valid_ratio': mean_ratio,
+                'total_turbines': len(year_results),
+                'total_hours': year_results['total_hours'].iloc[0]
+            })
+            print(f'{year}年平均有效率: {mean_ratio:.2%}')
 
     # 保存年度统计汇总
     summary_df = pd.DataFrame(yearly_stats)
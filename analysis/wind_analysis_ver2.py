@@ -4,7 +4,14 @@ import netCDF4 as nc
 import pandas as pd
 from datetime import datetime
 from tqdm import tqdm
-from scipy.spatial import cKDTree
+from concurrent.futures import ProcessPoolExecutor
+
+from wind_reader import WindCube, normalize_lon, read_grid_coords, unique_pixels
+from grid_index import GridDescriptor, FarmIndexCache, farm_index_cache_path
+from z0_coefficients import height_coefficients, height_columns
+from fingerprint import files_fingerprint
+
+HUB_HEIGHTS = [109.0]  # 轮毂高度（m），可同时计算多个高度
 
 
 def check_data_completeness(nc_dir):
@@ -50,8 +57,120 @@ def load_wind_power_locations(file_path):
         raise Exception(f"加载风电场位置数据失败: {str(e)}")
 
 
-def preprocess_roughness_data(z0_dir, power_plants):
-    """预处理粗糙度数据并计算平均Z0"""
+def masked_row_mean(values, keep):
+    """
+    每一行中 keep 为 True 的值的平均值（没有时为 NaN）
+
+    各行的保留值按原顺序左对齐后，按保留个数分组调用 np.mean，
+    求和顺序和累加精度与逐行对列表求平均完全相同。
+    """
+    result = np.full(len(values), np.nan)
+    counts = keep.sum(axis=1)
+    order = np.argsort(~keep, axis=1, kind='stable')
+    packed = np.take_along_axis(values, order, axis=1)
+    for count in np.unique(counts[counts > 0]):
+        rows = counts == count
+        result[rows] = np.mean(packed[rows, :count], axis=1)
+    return result
+
+
+class RoughnessPoints:
+    """
+    (月份 × 风电场) 的粗糙度表，只保存风电场像元上的值
+
+    Attributes:
+        months (list): (year, month)，顺序与读取文件的顺序相同
+        values (np.ndarray): (月份 × 风电场) float32 原始值
+        mask (np.ndarray): (月份 × 风电场) bool，缺测（填充值或 0）为 True
+    """
+
+    def __init__(self, months, values, mask):
+        self.months = [tuple(int(v) for v in key) for key in months]
+        self.values = values
+        self.mask = mask
+        self._row = {key: i for i, key in enumerate(self.months)}
+
+    def __contains__(self, key):
+        return tuple(key) in self._row
+
+    def get(self, year, month):
+        """某月各风电场的粗糙度，缺测为 NaN"""
+        row = self._row[(year, month)]
+        return np.where(self.mask[row], np.float32(np.nan), self.values[row])
+
+
+def read_roughness_points(path, lat_idx, lon_idx):
+    """
+    读取单个粗糙度文件中指定像元的值（在子进程中运行）
+
+    只读取用到的纬度行，峰值内存为 行数 × 经度数，而不是整幅网格及其掩膜。
+    """
+    rows, row_pos = np.unique(lat_idx, return_inverse=True)
+    with nc.Dataset(path, 'r') as ds:
+        block = ds.variables['Monthly_z0m_25km'][rows, :]
+    z0 = block[row_pos.ravel(), lon_idx]
+    mask = np.ma.getmaskarray(z0) | (np.ma.getdata(z0) == 0)
+    return np.ma.getdata(z0).astype(np.float32), mask
+
+
+def load_roughness_points(z0_dir, z0_files, lat_idx, lon_idx, cache_file=None, max_workers=None):
+    """
+    读取 2010-2020 年各月份粗糙度文件在风电场像元上的值
+
+    cache_file 指定时按文件签名、文件顺序和像元索引的指纹缓存，输入不变时直接读取。
+    """
+    files, months = [], []
+    for file in z0_files:
+        try:
+            year, month = int(file[:4]), int(file[4:6])
+        except ValueError:
+            print(f"跳过无法解析的文件名: {file}")
+            continue
+        if 2010 <= year <= 2020:
+            files.append(os.path.join(z0_dir, file))
+            months.append((year, month))
+
+    lat_idx = np.asarray(lat_idx, dtype=np.int64)
+    lon_idx = np.asarray(lon_idx, dtype=np.int64)
+    expected = files_fingerprint(files, [os.path.basename(f) for f in files], lat_idx, lon_idx)
+    if cache_file is not None and os.path.exists(cache_file):
+        with np.load(cache_file) as data:
+            if str(data['fingerprint']) == expected:
+                print(f"粗糙度输入未变化，读取缓存: {cache_file}")
+                return RoughnessPoints(data['months'], data['values'], data['mask'])
+
+    loaded, values, mask = [], [], []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(read_roughness_points, f, lat_idx, lon_idx) for f in files]
+        for key, file, future in tqdm(list(zip(months, files, futures)), desc='加载粗糙度数据'):
+            try:
+                v, m = future.result()
+            except Exception as e:
+                print(f"加载文件{os.path.basename(file)}出错: {str(e)}")
+                continue
+            loaded.append(key)
+            values.append(v)
+            mask.append(m)
+    shape = (len(loaded), len(lat_idx))
+    points = RoughnessPoints(loaded, np.array(values, dtype=np.float32).reshape(shape),
+                             np.array(mask, dtype=bool).reshape(shape))
+
+    # 有文件读取失败时不写缓存，下次重新读取
+    if cache_file is not None and len(loaded) == len(files):
+        tmp_path = cache_file + '.tmp.npz'
+        np.savez(tmp_path, fingerprint=expected, months=np.array(loaded, dtype=np.int64).reshape(-1, 2),
+                 values=points.values, mask=points.mask)
+        os.replace(tmp_path, cache_file)
+    return points
+
+
+def preprocess_roughness_data(z0_dir, power_plants, cache_file=None, max_workers=None, index_cache=None):
+    """
+    预处理粗糙度数据并计算平均Z0
+
+    Returns:
+        RoughnessPoints: 2010-2020 年各月份风电场像元上的粗糙度
+    """
     print("开始处理粗糙度数据...")
 
     z0_files = [f for f in os.listdir(z0_dir) if f.endswith('.nc')]
@@ -67,26 +186,15 @@ def preprocess_roughness_data(z0_dir, power_plants):
     print(f"粗糙度数据网格大小: {len(lats_z0)}x{len(lons_z0)}")
 
     # 调整经度到0-360范围
-    power_plants['Longitude'] = power_plants['Longitude'] % 360
-
-    # 构建粗糙度数据的KD树
-    lon_grid, lat_grid = np.meshgrid(lons_z0, lats_z0)
-    grid_points = np.column_stack((lat_grid.ravel(), lon_grid.ravel()))
-    tree = cKDTree(grid_points)
-
-    print("网格点构建完成，开始查找最近点...")
-
-    # 查询每个位置的最近网格点
-    query_points = power_plants[['Latitude', 'Longitude']].values
-    _, indices = tree.query(query_points)
+    power_plants['Longitude'] = normalize_lon(power_plants['Longitude'])
 
-    # 确保索引是整数类型
-    lat_indices = (indices // len(lons_z0)).astype(np.int32)
-    lon_indices = (indices % len(lons_z0)).astype(np.int32)
+    # 按网格坐标换算最近网格点（粗糙度经度为 -180~180，风电场经度跨经线时同样环绕）
+    lat_indices, lon_indices = find_nearest_grid_points_vectorized(
+        power_plants['Latitude'].values, power_plants['Longitude'].values,
+        lats_z0, lons_z0, index_cache, family='z0')
 
-    # 验证索引是否在有效范围内
-    if (lat_indices >= len(lats_z0)).any() or (lon_indices >= len(lons_z0)).any():
-        raise ValueError("计算出的索引超出网格范围")
+    if (lat_indices < 0).any():
+        raise ValueError("存在坐标缺失的风电场，无法确定网格索引")
 
     print(f"索引范围检查完成，lat_idx: [{lat_indices.min()}, {lat_indices.max()}], "
           f"lon_idx: [{lon_indices.min()}, {lon_indices.max()}]")
@@ -94,91 +202,74 @@ def preprocess_roughness_data(z0_dir, power_plants):
     power_plants['z0_lat_idx'] = lat_indices
     power_plants['z0_lon_idx'] = lon_indices
 
-    # 加载所有粗糙度数据
-    z0_monthly = {}
-    for file in tqdm(z0_files, desc='加载粗糙度数据'):
-        try:
-            year = int(file[:4])
-            month = int(file[4:6])
-            if not (2010 <= year <= 2020):
-                continue
-
-            with nc.Dataset(os.path.join(z0_dir, file), 'r') as ds:
-                z0 = ds.variables['Monthly_z0m_25km'][:]
-                z0 = np.ma.masked_equal(z0, 0)  # 处理缺失值
-                z0_monthly[(year, month)] = z0
-        except Exception as e:
-            print(f"加载文件{file}出错: {str(e)}")
-            continue
+    # 只读取风电场像元在各月份的粗糙度（按文件并行，结果缓存在磁盘上）
+    z0_points = load_roughness_points(z0_dir, z0_files, lat_indices, lon_indices, cache_file, max_workers)
+    print(f"成功加载了{len(z0_points.months)}个月份的粗糙度数据")
+
+    # 计算每个位置的平均Z0：(风电场 × 月份)
+    if z0_points.months:
+        values = z0_points.values.T
+        unmasked = ~z0_points.mask.T
+        # 优先使用正的有效值；没有时使用所有未掩膜的值；仍没有时取 0.03
+        positive = unmasked & (values > 0)
+        avg_z0 = masked_row_mean(values, positive)
+        fallback = ~positive.any(axis=1)
+        avg_z0[fallback] = masked_row_mean(values[fallback], unmasked[fallback])
+        avg_z0[fallback & ~unmasked.any(axis=1)] = 0.03
+    else:
+        avg_z0 = np.full(len(power_plants), 0.03)
 
-    print(f"成功加载了{len(z0_monthly)}个月份的粗糙度数据")
+    power_plants['avg_z0'] = avg_z0
+    return z0_points
 
-    # 计算每个位置的平均Z0
-    avg_z0 = np.zeros(len(power_plants))
-    for i in tqdm(range(len(power_plants)), desc='计算平均Z0'):
-        lat_idx = int(power_plants.iloc[i]['z0_lat_idx'])
-        lon_idx = int(power_plants.iloc[i]['z0_lon_idx'])
 
-        z0_values = []
-        for z0 in z0_monthly.values():
-            try:
-                val = z0[lat_idx, lon_idx]
-                if not np.ma.is_masked(val) and val > 0:
-                    z0_values.append(val)
-            except IndexError:
-                print(f"索引错误: lat_idx={lat_idx}, lon_idx={lon_idx}, z0.shape={z0.shape}")
-                continue
+def find_nearest_grid_points_vectorized(lats, lons, nc_lats, nc_lons, index_cache=None, family='wind'):
+    """按网格坐标直接换算最近网格点索引（经度跨 0/360 经线环绕）；指定 index_cache 时网格和坐标未变化直接取缓存"""
+    if index_cache is not None:
+        return index_cache.nearest(family, nc_lats, nc_lons, lats, lons)
+    return GridDescriptor(nc_lats, nc_lons).nearest(lats, lons)
 
-        # 计算该坐标点的平均值，如果没有任何有效值，则使用所有坐标点的平均值
-        if z0_values:
-            avg_z0[i] = np.mean(z0_values)
-        else:
-            # 计算所有坐标点的平均值
-            all_values = [z0[lat_idx, lon_idx] for z0 in z0_monthly.values() if not np.ma.is_masked(z0[lat_idx, lon_idx])]
-            avg_z0[i] = np.mean(all_values) if all_values else 0.03
 
-    power_plants['avg_z0'] = avg_z0
-    return z0_monthly
+def count_valid_hours(file_path, lat_idx, lon_idx, coeff, batch_size=50):
+    """
+    统计单个月份文件中各风电场的有效小时数（在子进程中运行）
 
+    coeff 为 (高度 × 风电场) 的修正系数，每个风速块只读取一次，按 (高度 × time × 风电场) 广播
 
-def find_nearest_grid_points_vectorized(lats, lons, nc_lats, nc_lons):
-    """向量化方式找到最近的网格点"""
-    # 调整经度到0-360范围
-    lons = np.where(lons < 0, lons + 360, lons)
-    # 构建网格点
-    lon_grid, lat_grid = np.meshgrid(nc_lons, nc_lats)
-    grid_points = np.column_stack((lat_grid.ravel(), lon_grid.ravel()))
-    tree = cKDTree(grid_points)
-    # 查询点
-    query_points = np.column_stack((lats, lons))
-    _, indices = tree.query(query_points)
-    lat_idx = indices // len(nc_lons)
-    lon_idx = indices % len(nc_lons)
-    return lat_idx, lon_idx
-
-
-def process_yearly_data(year, nc_files, nc_dir, power_plants, z0_monthly):
-    """处理特定年份的数据"""
-    print(f"\n开始处理{year}年的数据...")
+    Returns:
+        (valid_hours, n_hours): (高度 × 风电场) 的有效小时数（int64）和该文件的总小时数
+    """
+    valid_hours = np.zeros(coeff.shape, dtype=np.int64)
+    with WindCube(file_path) as cube:
+        # 批量处理数据（缺测值为NaN，不计入有效小时）
+        for _, _, wind_speed in cube.iter_point_blocks(lat_idx, lon_idx, batch_size):
+            # 修正风速并统计有效小时
+            wind_speed = wind_speed[None, :, :] * coeff[:, None, :]
+            valid = (wind_speed >= 5) & (wind_speed <= 20)
+            valid_hours += np.sum(valid, axis=1)
+        return valid_hours, cube.n_time
 
-    total_valid_hours = np.zeros(len(power_plants))
-    total_hours = 0
 
+def submit_yearly_data(year, nc_files, nc_dir, power_plants, z0_points, executor, hub_heights=HUB_HEIGHTS,
+                       index_cache=None):
+    """确定网格索引和各月修正系数，把该年的月份文件提交到进程池，返回 ([(文件名, future)], inverse)"""
     # 预处理网格点索引（第一个文件）
-    with nc.Dataset(os.path.join(nc_dir, nc_files[0]), 'r') as ds:
-        lats = ds.variables['lat'][:]
-        lons = ds.variables['lon'][:]
-        # 调整经度到0-360范围
-        lons = lons % 360
-        lat_idx, lon_idx = find_nearest_grid_points_vectorized(
-            power_plants['Latitude'].values,
-            power_plants['Longitude'].values,
-            lats, lons
-        )
-
-    print(f"已确定网格点索引，开始处理{len(nc_files)}个文件")
-
-    for file in nc_files:
+    lats, lons = read_grid_coords(os.path.join(nc_dir, nc_files[0]))
+    lat_idx, lon_idx = find_nearest_grid_points_vectorized(
+        power_plants['Latitude'].values,
+        power_plants['Longitude'].values,
+        lats, lons, index_cache
+    )
+
+    # 同一 (风速像元, 粗糙度像元) 的风电场修正系数和结果相同，只计算一次
+    _, first, inverse = unique_pixels(
+        lat_idx, lon_idx, power_plants['z0_lat_idx'].values, power_plants['z0_lon_idx'].values)
+    print(f"{len(power_plants)} 个风电场对应 {len(first)} 个唯一像元")
+    with WindCube(os.path.join(nc_dir, nc_files[0])) as cube:
+        print(f"读取计划: {cube.plan(lat_idx[first], lon_idx[first]).summary()}")
+
+    submitted = []
+    for file in sorted(nc_files):
         try:
             # 解析当前文件年月
             year_file = int(file.split('-')[0])
@@ -186,56 +277,89 @@ def process_yearly_data(year, nc_files, nc_dir, power_plants, z0_monthly):
 
             # 确定Z0值
             z0_values = None
-            if (year_file, month_file) in z0_monthly:
-                z0_data = z0_monthly[(year_file, month_file)]
-                z0_values = z0_data[
-                    power_plants['z0_lat_idx'].values,
-                    power_plants['z0_lon_idx'].values
-                ]
-                z0_values = np.ma.filled(z0_values, np.nan)
+            if (year_file, month_file) in z0_points:
+                z0_values = z0_points.get(year_file, month_file)
                 valid = ~np.isnan(z0_values) & (z0_values > 0)
                 z0 = np.where(valid, z0_values, power_plants['avg_z0'].values)
             else:
                 # 如果没有对应月份的Z0数据，使用该地点的平均值
                 z0 = power_plants['avg_z0'].values
 
-            # 计算修正系数
-            Z1, Z2 = 10.0, 109.0
-            coeff = np.log(Z2 / z0) / np.log(Z1 / z0)
+            # 计算各高度的修正系数
+            coeff = height_coefficients(z0, hub_heights)
+
+            future = executor.submit(count_valid_hours, os.path.join(nc_dir, file),
+                                     lat_idx[first], lon_idx[first], coeff[:, first])
+            submitted.append((file, future))
+        except Exception as e:
+            print(f"处理文件{file}时出错: {str(e)}")
+            continue
 
-            with nc.Dataset(os.path.join(nc_dir, file), 'r') as ds:
-                times = ds.variables['time'][:]
-                total_hours += len(times)
+    print(f"{year}年已提交{len(submitted)}个文件")
+    return submitted, inverse
 
-                # 批量处理数据
-                batch_size = 50
-                for batch in tqdm(range(0, len(times), batch_size), desc=f'处理{file}'):
-                    end = min(batch + batch_size, len(times))
-                    wind_speed = ds.variables['wind_speed'][batch:end]
 
-                    # 提取所有位置的风速并修正
-                    wind_speed = wind_speed[:, lat_idx, lon_idx]
-                    wind_speed = wind_speed * coeff
+def collect_yearly_data(year, submission, power_plants, hub_heights=HUB_HEIGHTS):
+    """
+    按文件名顺序归约各月份的部分结果（按唯一像元），结果与进程数无关，最后广播回各风电场
 
-                    # 统计有效小时
-                    valid = (wind_speed >= 5) & (wind_speed <= 20)
-                    total_valid_hours += np.sum(valid, axis=0)
+    只有一个轮毂高度时输出 valid_hours / valid_ratio 列，多个高度时输出 valid_hours_{h}m / valid_ratio_{h}m
+    """
+    submitted, inverse = submission
+    total_valid_hours = np.zeros((len(hub_heights), inverse.max() + 1), dtype=np.int64)
+    total_hours = 0
 
+    for file, future in tqdm(submitted, desc=f'汇总{year}年'):
+        try:
+            valid_hours, n_hours = future.result()
         except Exception as e:
             print(f"处理文件{file}时出错: {str(e)}")
             continue
+        total_valid_hours += valid_hours
+        total_hours += n_hours
 
     print(f"{year}年数据处理完成，总小时数: {total_hours}")
+    total_valid_hours = total_valid_hours[:, inverse].astype(np.float64)
 
-    return pd.DataFrame({
+    columns = {
         'Latitude': power_plants['Latitude'],
         'Longitude': power_plants['Longitude'],
-        'valid_hours': total_valid_hours,
-        'total_hours': total_hours,
-        'valid_ratio': total_valid_hours / total_hours,
-        'year': year,
-        'avg_z0': power_plants['avg_z0']  # 添加avg_z0列
-    })
+    }
+    for column, hours in zip(height_columns('valid_hours', hub_heights), total_valid_hours):
+        columns[column] = hours
+    columns['total_hours'] = total_hours
+    for column, hours in zip(height_columns('valid_ratio', hub_heights), total_valid_hours):
+        columns[column] = hours / total_hours
+    columns['year'] = year
+    columns['avg_z0'] = power_plants['avg_z0']  # 添加avg_z0列
+    return pd.DataFrame(columns)
+
+
+def process_yearly_data(year, nc_files, nc_dir, power_plants, z0_points, max_workers=None, hub_heights=HUB_HEIGHTS,
+                        index_cache=None):
+    """处理特定年份的数据，各月份文件在进程池中并行处理"""
+    print(f"\n开始处理{year}年的数据...")
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        submission = submit_yearly_data(year, nc_files, nc_dir, power_plants, z0_points, executor, hub_heights,
+                                        index_cache)
+        return collect_yearly_data(year, submission, power_plants, hub_heights)
+
+
+def result_fingerprint(year, nc_files, nc_dir, z0_dir, wind_loc_file, hub_heights):
+    """
+    某一年结果的输入指纹：该年的风速文件、全部粗糙度文件（平均 Z0 用到所有月份）、风电场表和参数
+
+    文件按大小和修改时间计入，任何一项变化都会使该年的缓存失效。
+    """
+    z0_files = [os.path.join(z0_dir, f) for f in os.listdir(z0_dir) if f.endswith('.nc')]
+    return files_fingerprint(
+        [os.path.join(nc_dir, f) for f in nc_files] + z0_files + [wind_loc_file],
+        year, {'hub_heights': [float(h) for h in hub_heights], 'valid_range': [5, 20]},
+    )
+
+
+def cached_result_path(cache_dir, year, fingerprint):
+    return os.path.join(cache_dir, f'result_{year}_{fingerprint[:16]}.csv')
 
 
 def main():
@@ -247,43 +371,86 @@ def main():
     z0_dir = r'G:\monthly aerodynamic roughness length dataset'
     output_dir = r'E:\PythonProjiects\Data_of_energy_competition\output'
     wind_loc_file = r'E:\PythonProjiects\Data_of_energy_competition\filtered_wind_farm.xlsx'
+    hub_heights = HUB_HEIGHTS  # 例如 [80.0, 100.0, 120.0, 140.0] 可一次比较多个轮毂高度
+    cache_dir = os.path.join(output_dir, 'cache')  # 按输入指纹缓存的逐年结果
 
     # 创建输出目录
     os.makedirs(output_dir, exist_ok=True)
+    os.makedirs(cache_dir, exist_ok=True)
 
     try:
-        # 加载风电场位置
-        print("加载风电场位置数据...")
-        power_plants = load_wind_power_locations(wind_loc_file)
-        print(f"成功加载{len(power_plants)}个风电场位置")
-
-        # 预处理粗糙度数据
-        print("\n开始预处理粗糙度数据...")
-        z0_monthly = preprocess_roughness_data(z0_dir, power_plants)
-
         # 检查数据完整性
         print("\n检查数据完整性...")
         completeness_df, files_by_year = check_data_completeness(nc_dir)
         print("数据完整性检查结果:")
         print(completeness_df)
 
-        # 处理每年数据
+        # 输入没有变化的年份直接读取缓存
+        fingerprints = {
+            year: result_fingerprint(year, files, nc_dir, z0_dir, wind_loc_file, hub_heights)
+            for year, files in files_by_year.items()
+        }
+        results = {}
+        for year, fingerprint in fingerprints.items():
+            cache_file = cached_result_path(cache_dir, year, fingerprint)
+            if os.path.exists(cache_file):
+                results[year] = pd.read_csv(cache_file, float_precision='round_trip')
+        pending_years = sorted(set(files_by_year) - set(results))
+        print(f"{len(results)}个年份的输入未变化，使用缓存结果；需要重新计算: {pending_years}")
+
+        if pending_years:
+            # 加载风电场位置
+            print("加载风电场位置数据...")
+            power_plants = load_wind_power_locations(wind_loc_file)
+            print(f"成功加载{len(power_plants)}个风电场位置")
+
+            # 风电场在风速/粗糙度网格上的索引缓存：网格和风电场坐标不变时直接复用
+            index_cache = FarmIndexCache(farm_index_cache_path(output_dir), wind_loc_file)
+
+            # 预处理粗糙度数据
+            print("\n开始预处理粗糙度数据...")
+            z0_points = preprocess_roughness_data(
+                z0_dir, power_plants, cache_file=os.path.join(cache_dir, 'roughness_points.npz'),
+                index_cache=index_cache)
+
+            # 处理需要重新计算的年份：所有月份文件一次性提交到同一个进程池，再按年份顺序汇总
+            with ProcessPoolExecutor() as executor:
+                submissions = {}
+                for year in pending_years:
+                    try:
+                        submissions[year] = submit_yearly_data(
+                            year, files_by_year[year], nc_dir, power_plants, z0_points, executor, hub_heights,
+                            index_cache)
+                    except Exception as e:
+                        print(f"处理{year}年数据时出错: {str(e)}")
+                index_cache.save()
+
+                for year, submission in submissions.items():
+                    try:
+                        print(f'\n处理年份: {year}')
+                        df = collect_yearly_data(year, submission, power_plants, hub_heights)
+                        results[year] = df
+                        # 只有全部月份文件都处理成功时才写入缓存，避免把不完整的结果当作有效缓存
+                        n_ok = sum(future.exception() is None for _, future in submission[0])
+                        if n_ok == len(files_by_year[year]):
+                            df.to_csv(cached_result_path(cache_dir, year, fingerprints[year]), index=False)
+                        else:
+                            print(f"{year}年有{len(files_by_year[year]) - n_ok}个文件处理失败，结果不写入缓存")
+                    except Exception as e:
+                        print(f"处理{year}年数据时出错: {str(e)}")
+                        continue
+
         yearly_results = []
-        for year, files in files_by_year.items():
-            try:
-                print(f'\n处理年份: {year}')
-                df = process_yearly_data(year, files, nc_dir, power_plants, z0_monthly)
-                output_file = os.path.join(output_dir, f'result_{year}.csv')
-                df.to_csv(output_file, index=False)
-                print(f"已保存{year}年结果到: {output_file}")
-
-                yearly_results.append({
-                    'year': year,
-                    'avg_ratio': df['valid_ratio'].mean()
-                })
-            except Exception as e:
-                print(f"处理{year}年数据时出错: {str(e)}")
-                continue
+        for year, df in sorted(results.items()):
+            output_file = os.path.join(output_dir, f'result_{year}.csv')
+            df.to_csv(output_file, index=False)
+            print(f"已保存{year}年结果到: {output_file}")
+
+            summary = {'year': year}
+            for column, ratio in zip(height_columns('avg_ratio', hub_heights),
+                                     height_columns('valid_ratio', hub_heights)):
+                summary[column] = df[ratio].mean()
+            yearly_results.append(summary)
 
         # 保存汇总结果
         summary_file = os.path.join(output_dir, 'summary.csv')
@@ -5,9 +5,24 @@ import xarray as xr
 from pathlib import Path
 from tqdm import tqdm
 import warnings
-from concurrent.futures import ProcessPoolExecutor
 from functools import partial
 
+from wind_reader import WindCube, unique_pixels
+from wind_histogram import (histogram_edges, accumulate_histogram, histogram_path,
+                            save_month_histogram, save_farm_mapping)
+from power_curve import POWER_CURVES, CurveSet, annual_capacity_factor
+from weibull import weibull_sums, weibull_table
+from quantile_sketch import QuantileSketch
+from z0_coefficients import load_coefficient_table, height_columns, count_band_hours
+from pipeline import Stage, Pipeline, StageIncomplete, stage_pool
+from dask_backend import compute_band_hours
+from wind_maps import grid_mapping, month_map, MapWriter, add_month
+from interpolation import PointInterpolator
+from regrid_z0 import regrid_directory
+from z0_climatology import month_climatology
+from grid_index import FarmIndexCache, farm_index_cache_path
+from fingerprint import files_fingerprint
+
 warnings.filterwarnings('ignore')
 
 # ----------------------
@@ -17,191 +32,551 @@ wind_dir = Path(r"G:/windspeed")
 roughness_dir = Path(r"G:/monthly aerodynamic roughness length dataset")
 output_dir = Path(r"E:\PythonProjiects\Data_of_energy_competition\output")
 farm_file = Path(r"E:\PythonProjiects\Data_of_energy_competition\preprocessing\filtered_wind_farm.xlsx")
-
-
-# ----------------------
-# 全局函数定义 (确保可序列化)
-# ----------------------
-def find_nearest(lat_array, lon_array, target_lat, target_lon):
-    """查找最近网格索引"""
-    lat_idx = np.abs(lat_array - target_lat).argmin()
-    lon_idx = np.abs(lon_array - (target_lon % 360)).argmin()  # 处理经度环绕
-    return lat_idx, lon_idx
-
-
-def process_row(row, wind_coords, z0_coords):
-    """处理单行数据"""
-    try:
-        # 解包坐标数据
-        wind_lat, wind_lon = wind_coords['lat'], wind_coords['lon']
-        z0_lat, z0_lon = z0_coords['lat'], z0_coords['lon']
-
-        # 计算索引
-        w_lat_idx, w_lon_idx = find_nearest(wind_lat, wind_lon, row.Latitude, row.Longitude)
-        z_lat_idx, z_lon_idx = find_nearest(z0_lat, z0_lon, row.Latitude, row.Longitude)
-        return (w_lat_idx, w_lon_idx, z_lat_idx, z_lon_idx)
-    except Exception as e:
-        print(f"处理坐标({row.Latitude}, {row.Longitude})时出错: {str(e)}")
-        return (-1, -1, -1, -1)
+hub_heights = [109]              # 轮毂高度（m），可同时计算多个高度，第一个为主高度
+archive_years = range(1990, 2025)  # 修正系数表覆盖的年份
+aligned_z0 = False               # 使用重映射到风速网格的粗糙度（regrid_z0.py），z0 与风速共用像元索引
+aligned_z0_dir = output_dir / "z0_era5"
 
 
 # ----------------------
 # 预处理阶段：生成月平均粗糙度
 # ----------------------
-def generate_monthly_z0mean():
-    """生成2010-2020年各月平均粗糙度文件"""
+def generate_monthly_z0mean(max_workers=None):
+    """
+    生成2010-2020年各月平均粗糙度文件
+
+    每个月份在子进程中逐年累加（零值在累加前视为缺测），12 个月份并行；
+    输出同时包含年际标准差 z0_std 和有效年数 z0_count。
+    """
     avg_z0_dir = output_dir / "monthly_average_z0"
     avg_z0_dir.mkdir(parents=True, exist_ok=True)
 
-    for month in tqdm(range(1, 13), desc="生成月平均粗糙度"):
+    tasks = {}
+    for month in range(1, 13):
         # 收集同月所有年份文件
         pattern = f"*{month:02d}15_global_monthly_z0m_25km.nc"
         files = list(roughness_dir.glob(pattern))
-
         if not files:
             print(f"警告: 未找到{month:02d}月的粗糙度文件")
             continue
+        tasks[month] = files
 
-        # 计算时空平均
-        with xr.open_mfdataset(files, combine='nested', concat_dim='time') as ds:
-            z0_mean = ds['Monthly_z0m_25km'].mean(dim='time', skipna=True)
-            z0_mean = z0_mean.where(z0_mean != 0)  # 处理缺失值标记
-
-        # 保存为相同格式的新文件
-        output_file = avg_z0_dir / f"mean_{month:02d}_z0m.nc"
-        z0_mean.to_netcdf(
-            output_file,
-            encoding={'Monthly_z0m_25km': {'zlib': True, 'complevel': 5}}
-        )
+    with stage_pool(max_workers=max_workers) as executor:
+        futures = {
+            month: executor.submit(month_climatology, files, avg_z0_dir / f"mean_{month:02d}_z0m.nc")
+            for month, files in tasks.items()
+        }
+        failed = []
+        for month, future in tqdm(futures.items(), desc="生成月平均粗糙度"):
+            try:
+                future.result()
+            except Exception as e:
+                failed.append(month)
+                print(f"生成{month:02d}月平均粗糙度时出错: {str(e)}")
+    if failed:
+        raise StageIncomplete(f"{len(failed)} 个月份的平均粗糙度生成失败: {failed}")
 
 
 # ----------------------
 # 预处理阶段：建立风电场索引
 # ----------------------
-def precompute_farm_indices():
-    """预计算风电场索引（Windows兼容版）"""
-    # 加载样本数据
-    with xr.open_dataset(next(wind_dir.glob("*.nc"))) as sample_wind:
-        wind_coords = {
-            'lat': sample_wind.lat.values,
-            'lon': sample_wind.lon.values
-        }
-
-    with xr.open_dataset(next(roughness_dir.glob("*.nc"))) as sample_z0:
-        z0_coords = {
-            'lat': sample_z0.lat.values,
-            'lon': sample_z0.lon.values
-        }
+def farm_indices():
+    """
+    读取风电场表，返回带风速网格和粗糙度网格索引的有效风电场
+
+    索引保存在输出目录下各脚本共用的 farm_index_cache.npz 中（按风电场表区分条目），按网格坐标和风电场坐标的指纹校验，
+    风电场表或网格变化时自动重新计算，否则直接读取。
+    """
+    # 与 farm_indices 阶段的输入指纹使用同一个文件（排序后的第一个）
+    with xr.open_dataset(sorted(wind_dir.glob("*.nc"))[0]) as sample_wind:
+        wind_lat, wind_lon = sample_wind.lat.values, sample_wind.lon.values
+    with xr.open_dataset(sorted(roughness_dir.glob("*.nc"))[0]) as sample_z0:
+        z0_lat, z0_lon = sample_z0.lat.values, sample_z0.lon.values
 
     # 加载风电场位置
     farms = pd.read_excel(farm_file)
-    print(f"正在处理 {len(farms)} 个风电场...")
-
-    # 准备参数列表
-    params = [(row, wind_coords, z0_coords) for row in farms.itertuples()]
-
-    # 多进程处理
-    with ProcessPoolExecutor() as executor:
-        results = list(tqdm(
-            executor.map(partial(process_row, wind_coords=wind_coords, z0_coords=z0_coords),
-                         farms.itertuples()),
-            total=len(farms),
-            desc="预计算索引"
-        ))
+    cache = FarmIndexCache(farm_index_cache_path(output_dir), farm_file)
+    farms['wind_lat'], farms['wind_lon'] = cache.nearest('wind', wind_lat, wind_lon,
+                                                         farms['Latitude'], farms['Longitude'])
+    farms['z0_lat'], farms['z0_lon'] = cache.nearest('z0', z0_lat, z0_lon, farms['Latitude'], farms['Longitude'])
+    cache.save()
 
-    # 保存结果
-    farms[['wind_lat', 'wind_lon', 'z0_lat', 'z0_lon']] = results
+    # 坐标缺失的风电场索引为 -1
     valid_farms = farms[(farms['wind_lat'] >= 0) & (farms['z0_lat'] >= 0)]
-    valid_farms.to_csv(output_dir / "wind_farm_indices.csv", index=False)
     print(f"成功处理 {len(valid_farms)}/{len(farms)} 个有效风电场")
+    return valid_farms
+
+
+def precompute_farm_indices():
+    """预计算风电场在风速网格和粗糙度网格上的最近格点索引，保存为 wind_farm_indices.csv"""
+    farm_indices().to_csv(output_dir / "wind_farm_indices.csv", index=False)
 
 
 # ----------------------
 # 核心处理函数
 # ----------------------
-def process_windspeed():
-    # 加载预计算数据
-    try:
-        farms = pd.read_csv(output_dir / "wind_farm_indices.csv")
-    except FileNotFoundError:
-        print("错误: 未找到预计算的索引文件，请先运行预处理步骤")
-        return
+def select_z0_file(year, month):
+    """2010-2020年使用当月粗糙度，其余年份使用月平均粗糙度；aligned_z0 时使用重映射后的同名文件"""
+    if 2010 <= year <= 2020:
+        name = f"{year}{month:02d}15_global_monthly_z0m_25km.nc"
+        return (aligned_z0_dir if aligned_z0 else roughness_dir) / name
+    name = f"mean_{month:02d}_z0m.nc"
+    return (aligned_z0_dir / "monthly_average" if aligned_z0 else output_dir / "monthly_average_z0") / name
+
+
+def regrid_roughness():
+    """把逐月粗糙度和月平均粗糙度重映射到风速网格（只处理新增或更新的文件）"""
+    sample_wind = next(wind_dir.glob("*.nc"))
+    regrid_directory(roughness_dir, aligned_z0_dir, sample_wind)
+    regrid_directory(output_dir / "monthly_average_z0", aligned_z0_dir / "monthly_average", sample_wind)
+
+
+def process_month(wind_file, adjustment, w_lat_idx, w_lon_idx, hour_columns=('valid_hours',), hist_path=None,
+                  curves=None, weibull=False, sketch=None, interpolator=None):
+    """
+    处理单个月份文件（在子进程中运行）
+
+    adjustment 为各像元当月 (高度 × 像元) 的修正系数（来自预先计算的系数表），粗糙度无效的像元为 NaN；
+    指定 interpolator（PointInterpolator）时风速由周围格点插值得到，此时“像元”即插值点；
+    每个高度的有效小时数记入 hour_columns 中对应的列，风速只读取一次。
+    以下附加统计均按第一个（主）高度计算：
+
+    指定 hist_path 时，同时把轮毂高度风速的逐像元直方图保存到该文件；
+    指定 curves（CurveSet）时，在同一次读取中计算各功率曲线的满发小时数；
+    weibull=True 时同时返回 Weibull 拟合所需的 Σu 和 Σu²；
+    指定 sketch（QuantileSketch 模板）时同时返回有效像元的分位数草图分桶计数 'sketch'
+
+    Returns:
+        (valid_farm, stats): 粗糙度有效的像元掩码，以及这些像元的逐月统计量
+        {'valid_hours': ..., 'data_hours': ..., 'flh_{曲线名}': ..., 'speed_sum': ..., 'speed_sumsq': ...}；
+        没有有效像元时返回 None
+    """
+    valid_farm = ~np.isnan(adjustment[0])
+    if not valid_farm.any():
+        return None
+    adjustment = adjustment[:, valid_farm]
+
+    # 加载风速数据：按时间块一次性提取所有风电场像元，得到 (time × farm) 数组
+    with WindCube(wind_file) as cube:
+        if interpolator is None:
+            u10 = cube.read_points(w_lat_idx[valid_farm], w_lon_idx[valid_farm])
+        else:
+            cells = cube.read_points(interpolator.cell_lat, interpolator.cell_lon)
+            u10 = interpolator.apply(cells)[:, valid_farm]
+
+    # 调整风速并统计各高度的有效时间
+    stats = dict(zip(hour_columns, count_band_hours(u10, adjustment)))
+    u109 = u10 * adjustment[0]
+
+    if curves is not None:
+        flh, stats['data_hours'] = curves.full_load_hours(u109)
+        for name, values in zip(curves.names, flh):
+            stats[f'flh_{name}'] = values
+    if weibull:
+        stats['data_hours'], stats['speed_sum'], stats['speed_sumsq'] = weibull_sums(u109)
+    if sketch is not None:
+        stats['sketch'] = sketch.bucket_counts(u109)
+
+    if hist_path is not None:
+        edges = histogram_edges()
+        counts = np.zeros((len(valid_farm), len(edges) - 1), dtype=np.int32)
+        counts[valid_farm] = accumulate_histogram(u109, edges)
+        save_month_histogram(hist_path, counts, edges, valid_farm)
+    return valid_farm, stats
+
+
+def process_windspeed(max_workers=None, histogram_dir=None, power_curves=None, weibull=False, sketch_path=None,
+                      heights=None, backend="process", memory_limit="4GB", interpolation="nearest"):
+    """
+    统计各风电场每年的有效小时数
+
+    Args:
+        max_workers: 并行处理月份文件的进程数
+        heights: 轮毂高度列表，默认为 hub_heights；多个高度时输出 valid_hours_{h}m 列，
+            以下附加统计按第一个高度计算
+        histogram_dir: 指定时同时保存每月逐像元的轮毂高度风速直方图（0.1 m/s 分箱），
+            之后可用 wind_histogram.annual_band_hours 按任意风速区间重新统计
+        power_curves: 功率曲线列表（POWER_CURVES 中的名称、CSV 路径或 PowerCurve），
+            指定时同时输出按装机容量计算的年度发电量和容量系数 annual_capacity_factor.csv
+        weibull: 为 True 时同时输出逐月的 Weibull 参数表 monthly_weibull.csv
+        sketch_path: 指定时把轮毂高度风速累加到该文件保存的分位数草图中（已计入的月份跳过），
+            并输出全时段的 P10/P50/P90 wind_speed_quantiles.csv
+        backend: "process" 为按月份的进程池；"dask" 把所有月份组织为一个分块的任务图，
+            在本地多进程调度器上按 memory_limit（每个工作进程）流式计算，只支持有效小时数统计
+        interpolation: "nearest" 取最近格点；"bilinear" / "idw" 用周围四个格点插值到风电场坐标
+            （稀疏权重矩阵预先计算一次，每个时间块一次稀疏矩阵乘法）
+    """
+    if backend == "dask" and (histogram_dir or power_curves or weibull or sketch_path or interpolation != "nearest"):
+        raise ValueError("dask 后端只支持最近格点的有效小时数统计，其余选项请使用 process 后端")
+
+    # 风电场索引（风电场表或网格变化时自动更新）
+    farms = farm_indices().reset_index(drop=True)
+    if aligned_z0:
+        # 重映射后的粗糙度与风速同一网格，直接使用风速像元索引
+        farms['z0_lat'], farms['z0_lon'] = farms['wind_lat'], farms['wind_lon']
 
     all_results = []
-
-    # 处理每个风速文件
-    wind_files = list(wind_dir.glob("*.nc"))
-    for wind_file in tqdm(wind_files, desc="处理风速文件"):
+    heights = list(heights or hub_heights)
+    hour_columns = height_columns('valid_hours', heights)
+    farm_lat = farms['Latitude'].values
+    farm_lon = farms['Longitude'].values
+    curves = CurveSet(power_curves) if power_curves else None
+    farm_capacity = farms['Capacity (MW)'].fillna(0).values if curves is not None else None
+
+    # 同一 (风速像元, 粗糙度像元) 的风电场结果完全相同，只计算一次再广播回各风电场；
+    # 插值时结果取决于风电场的精确坐标，按 (坐标, 粗糙度像元) 去重
+    if interpolation == "nearest":
+        (w_lat_idx, w_lon_idx, z_lat_idx, z_lon_idx), first, inverse = unique_pixels(
+            farms['wind_lat'], farms['wind_lon'], farms['z0_lat'], farms['z0_lon'])
+        pixel_keys = np.column_stack([w_lat_idx, w_lon_idx, z_lat_idx, z_lon_idx])
+        interpolator = None
+    else:
+        _, coord_id = np.unique(np.column_stack([farm_lat, farm_lon]), axis=0, return_inverse=True)
+        (point_id, z_lat_idx, z_lon_idx), first, inverse = unique_pixels(
+            coord_id.ravel(), farms['z0_lat'], farms['z0_lon'])
+        w_lat_idx = farms['wind_lat'].values[first]
+        w_lon_idx = farms['wind_lon'].values[first]
+        pixel_keys = np.column_stack([point_id, z_lat_idx, z_lon_idx, np.full(len(first), -1)])
+        with WindCube(next(wind_dir.glob("*.nc"))) as cube:
+            interpolator = PointInterpolator(cube.lat, cube.lon, farm_lat[first], farm_lon[first],
+                                             method=interpolation)
+        print(f"{interpolation} 插值使用 {len(interpolator.cell_lat)} 个风速格点")
+    print(f"{len(farms)} 个风电场对应 {len(w_lat_idx)} 个唯一像元")
+    worker = partial(
+        process_month,
+        w_lat_idx=w_lat_idx,
+        w_lon_idx=w_lon_idx,
+        hour_columns=hour_columns,
+        curves=curves,
+        weibull=weibull,
+        interpolator=interpolator,
+    )
+    if histogram_dir is not None:
+        histogram_dir = Path(histogram_dir)
+        histogram_dir.mkdir(parents=True, exist_ok=True)
+        save_farm_mapping(histogram_dir, inverse, farm_lat, farm_lon)
+
+    # 收集月份文件，按文件名排序保证汇总顺序固定
+    tasks = []
+    for wind_file in sorted(wind_dir.glob("*.nc")):
         try:
-            # 解析时间信息
             year, month = map(int, wind_file.stem.split("_")[0].split("-"))
-
-            # 加载粗糙度数据
-            if 2010 <= year <= 2020:
-                z0_file = roughness_dir / f"{year}{month:02d}15_global_monthly_z0m_25km.nc"
+        except ValueError:
+            print(f"跳过无法解析的文件名: {wind_file.name}")
+            continue
+        tasks.append((year, month, wind_file))
+
+    # 修正系数表：粗糙度输入不变时直接读取缓存，循环中只需一次乘法
+    months = {(year, month) for year in archive_years for month in range(1, 13)}
+    months |= {(year, month) for year, month, _ in tasks}
+    coefficients = load_coefficient_table(
+        output_dir / "z0_coefficients.npz",
+        {(year, month): select_z0_file(year, month) for year, month in months},
+        z_lat_idx, z_lon_idx, heights, max_workers=max_workers,
+    )
+    missing = [(year, month) for year, month, _ in tasks if (year, month) not in coefficients]
+    for year, month in missing:
+        print(f"警告: 未找到粗糙度文件 {select_z0_file(year, month)}")
+    tasks = [task for task in tasks if task[:2] not in missing]
+
+    if sketch_path is not None:
+        # 草图跨运行累加：轮毂高度、插值方式或所用粗糙度文件变化时，已计入的月份不再可比，重新建立
+        z0_files = {select_z0_file(year, month) for year, month in months}
+        source = files_fingerprint([f for f in z0_files if f.exists()], float(heights[0]), interpolation, aligned_z0)
+        sketch = QuantileSketch.load_or_create(sketch_path, pixel_keys, source=source)
+        # 子进程只需要分桶参数，传不含计数的模板
+        sketch_template = QuantileSketch(0, sketch.alpha, sketch.min_value, sketch.max_value)
+
+    if tasks:
+        with WindCube(tasks[0][2]) as cube:
+            if interpolator is None:
+                print(f"读取计划: {cube.plan(w_lat_idx, w_lon_idx).summary()}")
             else:
-                z0_file = output_dir / "monthly_average_z0" / f"mean_{month:02d}_z0m.nc"
-
-            if not z0_file.exists():
-                print(f"警告: 未找到粗糙度文件 {z0_file}")
-                continue
-
-            with xr.open_dataset(z0_file) as z0_data:
-                z0_values = z0_data['Monthly_z0m_25km'].where(z0_data['Monthly_z0m_25km'] > 0)
-
-                # 加载风速数据
-                with xr.open_dataset(wind_file) as wind_data:
-                    u10 = wind_data['wind_speed'].where(wind_data['wind_speed'] != -9999.0)
-
-                    # 处理每个风电场
-                    for _, farm in farms.iterrows():
-                        try:
-                            # 提取粗糙度
-                            z0 = z0_values.isel(
-                                lat=int(farm['z0_lat']),
-                                lon=int(farm['z0_lon'])
-                            ).item()
-
-                            if np.isnan(z0) or z0 <= 0:
-                                continue
-
-                            # 提取风速
-                            u10_series = u10.isel(
-                                lat=int(farm['wind_lat']),
-                                lon=int(farm['wind_lon'])
-                            ).values
-
-                            # 计算调整系数
-                            with np.errstate(divide='ignore'):
-                                adjustment = np.log(109 / z0) / np.log(10 / z0)
-
-                            # 调整风速并统计有效时间
-                            u109 = u10_series * adjustment
-                            valid_hours = np.sum((u109 >= 5) & (u109 <= 20) & (~np.isnan(u109)))
-
-                            all_results.append({
-                                'year': year,
-                                'month': month,
-                                'lat': farm['Latitude'],
-                                'lon': farm['Longitude'],
-                                'valid_hours': valid_hours
-                            })
-
-                        except Exception as e:
-                            print(f"处理风电场({farm['Latitude']}, {farm['Longitude']})时出错: {str(e)}")
-
-        except Exception as e:
-            print(f"处理文件 {wind_file} 时发生严重错误: {str(e)}")
+                print(f"读取计划: {cube.plan(interpolator.cell_lat, interpolator.cell_lon).summary()}")
+
+    def iter_month_results():
+        """按任务顺序返回 ((year, month, wind_file), result)，result 与 process_month 的返回值相同"""
+        if backend == "dask":
+            month_coeff = [coefficients.get(year, month) for year, month, _ in tasks]
+            hours = compute_band_hours([wind_file for _, _, wind_file in tasks], w_lat_idx, w_lon_idx,
+                                       month_coeff, n_workers=max_workers, memory_limit=memory_limit)
+            for task, coeff, month_hours in zip(tasks, month_coeff, hours):
+                valid_pixel = ~np.isnan(coeff[0])
+                result = (valid_pixel, dict(zip(hour_columns, month_hours[:, valid_pixel])))
+                yield task, result if valid_pixel.any() else None
+            return
+
+        def submit(year, month, wind_file):
+            return executor.submit(
+                worker, wind_file, coefficients.get(year, month),
+                hist_path=histogram_path(histogram_dir, year, month) if histogram_dir else None,
+                sketch=sketch_template if sketch_path and not sketch.has_month(f"{year}-{month:02d}") else None,
+            )
+
+        # 多进程并行处理各月份，结果按提交顺序汇总，与进程数无关；
+        # 同时在途的月份数有上限，每个月的结果（含草图计数）汇总后即释放
+        workers = max_workers or os.cpu_count() or 1
+        window = 2 * workers
+        with stage_pool(max_workers=workers) as executor:
+            in_flight = []
+            for i, task in enumerate(tasks):
+                while len(in_flight) < window and i + len(in_flight) < len(tasks):
+                    in_flight.append(submit(*tasks[i + len(in_flight)]))
+                future = in_flight.pop(0)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    failed.append(task[2].name)
+                    print(f"处理文件 {task[2]} 时发生严重错误: {str(e)}")
+                    continue
+                del future
+                yield task, result
+                del result
+
+    failed = []
+    for (year, month, wind_file), result in tqdm(iter_month_results(), total=len(tasks), desc="处理风速文件"):
+        if result is None:
             continue
+        valid_pixel, stats = result
+        sketch_counts = stats.pop('sketch', None)
+        if sketch_counts is not None:
+            sketch.merge(sketch_counts, valid_pixel, month=f"{year}-{month:02d}")
+        # 广播回各风电场
+        valid_farm = valid_pixel[inverse]
+        month_df = pd.DataFrame({
+            'year': year,
+            'month': month,
+            'lat': farm_lat[valid_farm],
+            'lon': farm_lon[valid_farm],
+        })
+        if curves is not None:
+            month_df['capacity'] = farm_capacity[valid_farm]
+        for key, values in stats.items():
+            pixel_values = np.zeros(len(valid_pixel), dtype=values.dtype)
+            pixel_values[valid_pixel] = values
+            month_df[key] = pixel_values[inverse][valid_farm]
+        all_results.append(month_df)
+
+    if sketch_path is not None:
+        sketch.save(sketch_path)
+        quantiles = sketch.quantile([0.1, 0.5, 0.9])[inverse]
+        pd.DataFrame({
+            'lat': farm_lat,
+            'lon': farm_lon,
+            'p10': quantiles[:, 0],
+            'p50': quantiles[:, 1],
+            'p90': quantiles[:, 2],
+            'n_hours': sketch.total()[inverse],
+        }).drop_duplicates(['lat', 'lon']).to_csv(output_dir / "wind_speed_quantiles.csv", index=False)
+        print(f"分位数草图已包含 {len(sketch.months)} 个月")
 
     # 汇总结果
-    result_df = pd.DataFrame(all_results)
+    result_df = pd.concat(all_results, ignore_index=True) if all_results else pd.DataFrame()
     if not result_df.empty:
-        annual_stats = result_df.groupby(['year', 'lat', 'lon'])['valid_hours'].sum().reset_index()
+        annual_stats = result_df.groupby(['year', 'lat', 'lon'])[hour_columns].sum().reset_index()
         annual_stats.to_csv(output_dir / "annual_valid_hours.csv", index=False)
+        if curves is not None:
+            annual_cf = annual_capacity_factor(result_df, curves.names)
+            annual_cf.to_csv(output_dir / "annual_capacity_factor.csv", index=False)
+        if weibull:
+            weibull_table(result_df).to_csv(output_dir / "monthly_weibull.csv", index=False)
         print("处理完成，结果已保存")
     else:
         print("警告: 未生成任何有效结果")
+    if failed:
+        # 其余月份的结果已保存；流程不记录本阶段的指纹，下次重新运行
+        raise StageIncomplete(f"{len(failed)} 个风速文件处理失败: {failed}")
+
+
+# ----------------------
+# 全球网格地图
+# ----------------------
+def compute_maps(max_workers=None, power_curves=None, height=None, years=None):
+    """
+    计算每个陆地网格逐年的有效小时比例（及容量系数），用于在现有风电场以外筛选新场址
+
+    各月份在进程池中处理，每个月份文件只完整读取一次；同时在途的月份数有上限，
+    按年份顺序累加后逐年写入 wind_maps.nc，内存占用与年份数无关。
+    wind_maps.nc 中记录每年输入（风速、粗糙度文件和参数）的指纹，只重新计算指纹变化的年份，
+    新增一个月时只处理该月所在的年份。
+
+    Args:
+        power_curves: 功率曲线列表，指定时同时输出 cf_{曲线名}
+        height: 轮毂高度，默认为 hub_heights 的第一个
+        years: 只处理这些年份，None 表示全部
+    """
+    height = height or hub_heights[0]
+    curves = CurveSet(power_curves) if power_curves else None
+    curve_names = curves.names if curves else ()
+
+    tasks = []
+    for wind_file in sorted(wind_dir.glob("*.nc")):
+        try:
+            year, month = map(int, wind_file.stem.split("_")[0].split("-"))
+        except ValueError:
+            print(f"跳过无法解析的文件名: {wind_file.name}")
+            continue
+        if years is not None and year not in years:
+            continue
+        z0_file = select_z0_file(year, month)
+        if not z0_file.exists():
+            print(f"警告: 未找到粗糙度文件 {z0_file}")
+            continue
+        tasks.append((year, month, wind_file, z0_file))
+    if not tasks:
+        print("警告: 没有可处理的月份")
+        return
+
+    year_files = {}
+    for year, _, wind_file, z0_file in tasks:
+        year_files.setdefault(year, set()).update([wind_file, z0_file])
+    year_fingerprint = {year: files_fingerprint(files, float(height), list(curve_names))
+                        for year, files in year_files.items()}
+
+    with WindCube(tasks[0][2]) as cube:
+        wind_lat, wind_lon = cube.lat, cube.lon
+    with MapWriter(output_dir / "wind_maps.nc", wind_lat, wind_lon, height, curve_names) as writer:
+        tasks = [task for task in tasks if writer.fingerprints.get(task[0]) != year_fingerprint[task[0]]]
+        if not tasks:
+            print("全球地图各年份的输入均未变化")
+            return
+        print(f"需要重新计算的年份: {sorted({task[0] for task in tasks})}")
+        lat_map, lon_map = grid_mapping(tasks[0][3], wind_lat, wind_lon)
+        worker = partial(month_map, lat_map=lat_map, lon_map=lon_map, height=height, curves=curves)
+
+        def write_year(year, totals, failed):
+            # 有月份失败的年份不记录指纹，下次重新计算
+            writer.write_year(year, totals, None if year in failed else year_fingerprint[year])
+
+        workers = max_workers or os.cpu_count() or 1
+        window = 2 * workers  # 同时在途（含已完成未汇总）的月份数上限
+        with stage_pool(max_workers=workers) as executor:
+            in_flight = []
+            current_year, totals, failed = None, None, set()
+            for i in tqdm(range(len(tasks)), desc="计算全球地图"):
+                while len(in_flight) < window and i + len(in_flight) < len(tasks):
+                    year, _, wind_file, z0_file = tasks[i + len(in_flight)]
+                    in_flight.append((year, executor.submit(worker, wind_file, z0_file)))
+                year, future = in_flight.pop(0)
+                if year != current_year and totals is not None:
+                    write_year(current_year, totals, failed)
+                    totals = None
+                current_year = year
+                try:
+                    totals = add_month(totals, future.result())
+                except Exception as e:
+                    failed.add(year)
+                    print(f"处理文件 {tasks[i][2]} 时发生严重错误: {str(e)}")
+            if totals is not None:
+                write_year(current_year, totals, failed)
+    print(f"全球地图已保存: {output_dir / 'wind_maps.nc'}")
+    if failed:
+        raise StageIncomplete(f"{len(failed)} 个年份有月份处理失败: {sorted(failed)}")
+
+
+# ----------------------
+# 汇总阶段
+# ----------------------
+def summarize_annual():
+    """按年份汇总有效小时数（及容量系数，如有）的风电场平均值，保存为 annual_summary.csv"""
+    annual_stats = pd.read_csv(output_dir / "annual_valid_hours.csv")
+    value_columns = [c for c in annual_stats.columns if c.startswith('valid_hours')]
+    summary = annual_stats.groupby('year')[value_columns].mean().add_prefix('mean_')
+    summary.insert(0, 'n_farms', annual_stats.groupby('year').size())
+
+    cf_file = output_dir / "annual_capacity_factor.csv"
+    if cf_file.exists():
+        annual_cf = pd.read_csv(cf_file)
+        cf_columns = [c for c in annual_cf.columns if c.startswith('cf_')]
+        summary = summary.join(annual_cf.groupby('year')[cf_columns].mean().add_prefix('mean_'))
+    summary.reset_index().to_csv(output_dir / "annual_summary.csv", index=False)
+
+
+# ----------------------
+# 流程定义
+# ----------------------
+def run_ingest():
+    """
+    把下载目录中新落地的文件合并/转换为风速 NetCDF（auto_ingest 的单轮处理）
+
+    输出写入 wind_dir，而不是 auto_ingest 默认按剩余空间选择的目录，
+    这样 ingest 阶段的输出就是 extraction 和 maps 读取的文件。
+    有文件失败或尚未下载完成时抛出 StageIncomplete，已转换的月份仍交给下游处理。
+    """
+    from auto_ingest import watch
+    result = watch(run_once=True, output_dirs=[str(wind_dir)])
+    if result["failed"] or result["deferred"]:
+        raise StageIncomplete(f"{len(result['failed'])} 个文件处理失败，{len(result['deferred'])} 个文件尚未下载完成")
+
+
+def ingest_inputs():
+    from auto_ingest import watch_directories, merge_directory
+    return list(watch_directories) + [merge_directory]
+
+
+def build_pipeline(include_ingest=True, maps=False, **windspeed_kwargs):
+    """
+    ver3 的阶段图：
+
+        ingest ─> farm_indices ─┐
+        z0_climatology ─────────┴─> extraction ─┬─> aggregation
+                                                └─> maps（可选）
+
+    ingest 与 z0_climatology 互不依赖，会同时运行；farm_indices 要读取风速文件，排在 ingest 之后。
+    ingest 每次都运行（下载目录的指纹无法反映推迟到下次的文件），其余阶段只有在输入文件、
+    上游输出或参数变化时才重新运行；阶段内有月份失败时不记录指纹，下次重新运行。
+    aligned_z0 为 True 时在 z0_climatology 之后加入 z0_regrid 阶段，extraction 和 maps 改为依赖它。
+    windspeed_kwargs 传给 process_windspeed，同时作为 extraction 阶段的参数计入指纹；
+    maps=True 时加入全球地图阶段（功率曲线与 extraction 相同）。maps 与 extraction 都会占满进程池，
+    因此排在 extraction 之后运行；maps 运行时只重新计算输入变化的年份。
+    """
+    z0_mean_dir = output_dir / "monthly_average_z0"
+    z0_stage = "z0_regrid" if aligned_z0 else "z0_climatology"
+    stages = [
+        Stage(
+            "z0_climatology", generate_monthly_z0mean,
+            inputs=[roughness_dir / "*.nc"],
+            outputs=[z0_mean_dir / f"mean_{month:02d}_z0m.nc" for month in range(1, 13)],
+        ),
+        Stage(
+            "farm_indices", precompute_farm_indices,
+            inputs=lambda: [farm_file] + sorted(wind_dir.glob("*.nc"))[:1] + sorted(roughness_dir.glob("*.nc"))[:1],
+            outputs=[output_dir / "wind_farm_indices.csv"],
+            deps=["ingest"] if include_ingest else [],
+        ),
+        Stage(
+            "extraction", partial(process_windspeed, **windspeed_kwargs),
+            inputs=[wind_dir / "*.nc", roughness_dir / "*.nc"],
+            outputs=[output_dir / "annual_valid_hours.csv"],
+            deps=[z0_stage, "farm_indices"] + (["ingest"] if include_ingest else []),
+            params={key: str(value) for key, value in windspeed_kwargs.items()} | {'aligned_z0': aligned_z0},
+        ),
+        Stage(
+            "aggregation", summarize_annual,
+            outputs=[output_dir / "annual_summary.csv"],
+            deps=["extraction"],
+        ),
+    ]
+    if maps:
+        power_curves = windspeed_kwargs.get('power_curves')
+        stages.append(Stage(
+            "maps", partial(compute_maps, power_curves=power_curves),
+            inputs=[wind_dir / "*.nc", roughness_dir / "*.nc"],
+            outputs=[output_dir / "wind_maps.nc"],
+            deps=[z0_stage, "extraction"] + (["ingest"] if include_ingest else []),
+            params={'power_curves': str(power_curves), 'hub_height': hub_heights[0], 'aligned_z0': aligned_z0},
+        ))
+    if aligned_z0:
+        stages.append(Stage(
+            "z0_regrid", regrid_roughness,
+            inputs=[roughness_dir / "*.nc"],
+            outputs=[aligned_z0_dir / "*.nc"] + [aligned_z0_dir / "monthly_average" / f"mean_{month:02d}_z0m.nc"
+                                                 for month in range(1, 13)],
+            deps=["z0_climatology"],
+        ))
+    if include_ingest:
+        stages.insert(0, Stage("ingest", run_ingest, inputs=ingest_inputs, outputs=[wind_dir / "*.nc"], always=True))
+    return Pipeline(stages, output_dir / "pipeline_state.json")
 
 
 # ----------------------
@@ -211,13 +586,12 @@ if __name__ == "__main__":
     # 创建输出目录
     output_dir.mkdir(parents=True, exist_ok=True)
 
-    # 步骤1：生成月平均粗糙度文件
-    if not (output_dir / "monthly_average_z0").exists():
-        generate_monthly_z0mean()
-
-    # 步骤2：预计算风电场索引
-    if not (output_dir / "wind_farm_indices.csv").exists():
-        precompute_farm_indices()
-
-    # 步骤3：处理所有风速数据
-    process_windspeed()
\ No newline at end of file
+    # 按阶段图运行：数据接收与 z0 月平均同时进行，风电场索引在数据接收之后，输入未变化的阶段跳过；
+    # 风速处理同时估算发电量和容量系数、拟合逐月 Weibull 参数、更新风速分位数草图
+    # 全球地图计算量大，需要时用 build_pipeline(maps=True, ...) 单独加入
+    pipeline = build_pipeline(
+        power_curves=list(POWER_CURVES),
+        weibull=True,
+        sketch_path=output_dir / "wind_quantile_sketch.npz",
+    )
+    pipeline.run()
\ No newline at end of file
@@ -0,0 +1,105 @@
+import re
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+# ----------------------
+# 分箱设置
+# ----------------------
+BINS_PER_MS = 10      # 每 m/s 的分箱数，即 0.1 m/s 一档
+MAX_SPEED = 40.0      # 最后一个常规分箱的上界，超过的计入溢出箱
+
+
+def histogram_edges(bins_per_ms=BINS_PER_MS, max_speed=MAX_SPEED):
+    """分箱边界 k / bins_per_ms，最后追加 inf 作为溢出箱"""
+    n_bins = int(round(max_speed * bins_per_ms))
+    return np.append(np.arange(n_bins + 1) / bins_per_ms, np.inf)
+
+
+def accumulate_histogram(speeds, edges, counts=None):
+    """
+    将 (time × 像元) 风速累加到 (像元 × 分箱) 计数中，NaN 不计入
+
+    分箱 k 对应 edges[k] <= u < edges[k + 1]
+    """
+    n_time, n_pixel = speeds.shape
+    n_bins = len(edges) - 1
+    if counts is None:
+        counts = np.zeros((n_pixel, n_bins), dtype=np.int32)
+    valid = ~np.isnan(speeds)
+    bins = np.searchsorted(edges, speeds[valid], side='right') - 1
+    pixel = np.broadcast_to(np.arange(n_pixel), speeds.shape)[valid]
+    counts += np.bincount(pixel * n_bins + bins, minlength=n_pixel * n_bins).reshape(n_pixel, n_bins).astype(counts.dtype)
+    return counts
+
+
+# ----------------------
+# 存取
+# ----------------------
+def histogram_path(hist_dir, year, month):
+    return Path(hist_dir) / f"{year}-{month:02d}_hist.npz"
+
+
+def save_month_histogram(path, counts, edges, valid_pixel):
+    """保存单月的像元直方图（uint16 足够容纳一个月的小时数）"""
+    np.savez_compressed(path, counts=counts.astype(np.uint16), edges=edges, valid_pixel=valid_pixel)
+
+
+def save_farm_mapping(hist_dir, inverse, lat, lon):
+    """保存风电场到像元的映射，查询时用来把像元结果广播回各风电场"""
+    np.savez_compressed(Path(hist_dir) / "farms.npz", inverse=inverse, lat=lat, lon=lon)
+
+
+def load_month_histogram(path):
+    with np.load(path) as data:
+        return data['counts'], data['edges'], data['valid_pixel']
+
+
+def iter_month_histograms(hist_dir):
+    """按年月顺序遍历直方图文件，返回 (year, month, counts, edges, valid_pixel)"""
+    pattern = re.compile(r'^(\d{4})-(\d{2})_hist\.npz$')
+    for path in sorted(Path(hist_dir).glob("*_hist.npz")):
+        match = pattern.match(path.name)
+        if match:
+            yield (int(match.group(1)), int(match.group(2))) + load_month_histogram(path)
+
+
+# ----------------------
+# 查询
+# ----------------------
+def band_hours(counts, edges, low, high):
+    """
+    统计风速在 [low, high) 内的小时数
+
+    low/high 落在分箱边界上时与 (u >= low) & (u < high) 完全一致，否则精度为一个分箱；
+    连续风速恰好等于 high 的概率可忽略，因此也可作为 (u >= low) & (u <= high) 的结果。
+    """
+    lo = np.searchsorted(edges, low, side='left')
+    hi = np.searchsorted(edges, high, side='left')
+    return counts[:, lo:hi].sum(axis=1, dtype=np.int64)
+
+
+def annual_band_hours(hist_dir, low=5.0, high=20.0):
+    """
+    只读直方图重新计算年度有效小时数，输出格式与 annual_valid_hours.csv 相同
+
+    可用于任意风速区间或切入/切出风速组合，无需重新读取风速数据。
+    """
+    with np.load(Path(hist_dir) / "farms.npz") as farms:
+        inverse, lat, lon = farms['inverse'], farms['lat'], farms['lon']
+
+    results = []
+    for year, month, counts, edges, valid_pixel in iter_month_histograms(hist_dir):
+        hours = band_hours(counts, edges, low, high)
+        valid_farm = valid_pixel[inverse]
+        results.append(pd.DataFrame({
+            'year': year,
+            'month': month,
+            'lat': lat[valid_farm],
+            'lon': lon[valid_farm],
+            'valid_hours': hours[inverse][valid_farm]
+        }))
+    if not results:
+        return pd.DataFrame(columns=['year', 'lat', 'lon', 'valid_hours'])
+    result_df = pd.concat(results, ignore_index=True)
+    return result_df.groupby(['year', 'lat', 'lon'])['valid_hours'].sum().reset_index()
@@ -0,0 +1,198 @@
+import os
+import numpy as np
+import netCDF4 as nc
+import xarray as xr
+
+from wind_reader import WindCube, normalize_lon
+from z0_coefficients import height_coefficients
+
+# ----------------------
+# 网格对应关系
+# ----------------------
+def nearest_index(axis, values, period=None):
+    """
+    一维坐标轴上的最近点索引（坐标轴可以升序或降序）
+
+    period 不为 None 时按周期坐标处理（例如经度取 360），首尾两个格点也视为相邻。
+    """
+    axis = np.asarray(axis, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    if period is not None:
+        axis = np.mod(axis, period)
+        values = np.mod(values, period)
+    order = np.argsort(axis, kind='stable')
+    sorted_axis = axis[order]
+    pos = np.searchsorted(sorted_axis, values)
+    candidates = np.stack([np.clip(pos - 1, 0, len(axis) - 1), np.clip(pos, 0, len(axis) - 1)])
+    if period is not None:
+        candidates = np.concatenate([candidates, np.broadcast_to([[0], [len(axis) - 1]], (2, len(values)))])
+    distance = np.abs(sorted_axis[candidates] - values)
+    if period is not None:
+        distance = np.minimum(distance, period - distance)
+    best = candidates[np.argmin(distance, axis=0), np.arange(len(values))]
+    return order[best]
+
+
+def grid_mapping(z0_file, wind_lat, wind_lon):
+    """风速网格每一行/列对应的最近粗糙度网格行/列"""
+    with xr.open_dataset(z0_file) as z0_data:
+        z0_lat, z0_lon = z0_data.lat.values, z0_data.lon.values
+    return nearest_index(z0_lat, wind_lat), nearest_index(z0_lon, normalize_lon(wind_lon), period=360)
+
+
+# ----------------------
+# 单月全球统计（在子进程中运行）
+# ----------------------
+def month_map(wind_file, z0_file, lat_map, lon_map, height, low=5, high=20, curves=None,
+              block_size=24, tile_rows=90):
+    """
+    统计单个月份每个网格的有效小时数
+
+    风速按时间块整幅读取（每个时刻只读取一次），计算按纬度带分块进行，
+    float64 的临时数组不超过 block_size × tile_rows × 经度数。
+    陆地由当月粗糙度是否有效确定，海洋格点不计入任何小时数。
+
+    Returns:
+        dict: 'valid_hours'、'data_hours'（int32 网格）、'land'（bool 网格），
+        以及指定 curves 时每条曲线的 'flh_{曲线名}'（满发小时数，float64 网格）
+    """
+    with xr.open_dataset(z0_file) as z0_data:
+        z0_values = z0_data['Monthly_z0m_25km'].where(z0_data['Monthly_z0m_25km'] > 0)
+        z0 = z0_values.values[np.ix_(lat_map, lon_map)].astype(np.float64)
+    coeff = height_coefficients(z0, [height])[0]
+    land = ~np.isnan(coeff)
+
+    shape = coeff.shape
+    result = {
+        'valid_hours': np.zeros(shape, dtype=np.int32),
+        'data_hours': np.zeros(shape, dtype=np.int32),
+        'land': land,
+    }
+    if curves is not None:
+        for name in curves.names:
+            result[f'flh_{name}'] = np.zeros(shape)
+
+    with WindCube(wind_file) as cube:
+        for _, _, block in cube.iter_blocks(block_size):
+            for r0 in range(0, shape[0], tile_rows):
+                r1 = min(r0 + tile_rows, shape[0])
+                if not land[r0:r1].any():
+                    continue
+                u = block[:, r0:r1, :] * coeff[r0:r1]
+                result['valid_hours'][r0:r1] += np.sum((u >= low) & (u <= high), axis=0, dtype=np.int32)
+                result['data_hours'][r0:r1] += np.sum(~np.isnan(u), axis=0, dtype=np.int32)
+                if curves is not None:
+                    flh, _ = curves.full_load_hours(u)
+                    for name, values in zip(curves.names, flh):
+                        result[f'flh_{name}'][r0:r1] += values
+    return result
+
+
+# ----------------------
+# 输出
+# ----------------------
+class MapWriter:
+    """
+    逐年写入全球地图 NetCDF（year 为无限维），内存中只保留当前年份的累加值
+
+    变量: valid_hours / data_hours（int32）、land_months（当年粗糙度有效的月数）、
+    valid_ratio（float32，海洋为 NaN），以及每条功率曲线的 cf_{曲线名}
+
+    已有文件的网格、轮毂高度、风速区间和功率曲线都相同时在原文件上更新：每年的输入指纹保存在
+    全局属性 fingerprint_{年份} 中，已有年份原位覆盖，新年份追加在末尾（year 坐标不一定升序）；
+    否则重新建立文件。
+    """
+
+    def __init__(self, path, lat, lon, height, curve_names=(), low=5, high=20):
+        self.curve_names = list(curve_names)
+        self.fingerprints = {}
+        self.year_index = {}
+        if self._compatible(path, lat, lon, height, low, high):
+            self.ds = nc.Dataset(path, "a")
+            for i, year in enumerate(self.ds["year"][:].tolist()):
+                self.year_index[year] = i
+                self.fingerprints[year] = getattr(self.ds, f"fingerprint_{year}", None)
+            self.n_years = len(self.year_index)
+            return
+        self.ds = nc.Dataset(path, "w")
+        self.ds.createDimension("year", None)
+        self.ds.createDimension("lat", len(lat))
+        self.ds.createDimension("lon", len(lon))
+        self.ds.createVariable("year", "i4", ("year",))
+        self.ds.createVariable("lat", "f4", ("lat",))[:] = lat
+        self.ds.createVariable("lon", "f4", ("lon",))[:] = lon
+        self.ds.hub_height = float(height)
+        self.ds.valid_range_ms = f"{low}-{high}"
+        dims = ("year", "lat", "lon")
+        chunks = (1, min(len(lat), 90), len(lon))
+        self.ds.createVariable("valid_hours", "i4", dims, zlib=True, chunksizes=chunks)
+        self.ds.createVariable("data_hours", "i4", dims, zlib=True, chunksizes=chunks)
+        self.ds.createVariable("land_months", "i2", dims, zlib=True, chunksizes=chunks)
+        ratio = self.ds.createVariable("valid_ratio", "f4", dims, zlib=True, chunksizes=chunks, fill_value=np.nan)
+        ratio.long_name = f"hours with {low} <= u({height:g} m) <= {high} m/s / hours with data"
+        for name in self.curve_names:
+            cf = self.ds.createVariable(f"cf_{name}", "f4", dims, zlib=True, chunksizes=chunks, fill_value=np.nan)
+            cf.long_name = f"capacity factor, power curve {name}"
+        self.n_years = 0
+
+    def _compatible(self, path, lat, lon, height, low, high):
+        """已有文件能否直接更新"""
+        if not os.path.exists(path):
+            return False
+        try:
+            with nc.Dataset(path) as ds:
+                curves = sorted(name[3:] for name in ds.variables if name.startswith("cf_"))
+                return (getattr(ds, "hub_height", None) == float(height)
+                        and getattr(ds, "valid_range_ms", None) == f"{low}-{high}"
+                        and curves == sorted(self.curve_names)
+                        and np.array_equal(np.asarray(ds["lat"][:]), np.asarray(lat, dtype=np.float32))
+                        and np.array_equal(np.asarray(ds["lon"][:]), np.asarray(lon, dtype=np.float32)))
+        except Exception as e:
+            print(f"无法读取已有地图 {path}，将重新建立: {str(e)}")
+            return False
+
+    def write_year(self, year, totals, fingerprint=None):
+        """
+        写入一年的累加结果（month_map 结果按月相加，'land' 相加为月数）
+
+        fingerprint 为该年输入的指纹，保存后 fingerprints[year] 与之相同的年份下次可以跳过；
+        为 None 时清除旧指纹（如该年有月份处理失败），下次重新计算。
+        """
+        i = self.year_index.get(year, self.n_years)
+        self.ds["year"][i] = year
+        self.ds["valid_hours"][i] = totals['valid_hours']
+        self.ds["data_hours"][i] = totals['data_hours']
+        self.ds["land_months"][i] = totals['land']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            data_hours = np.where(totals['data_hours'] > 0, totals['data_hours'], np.nan)
+            self.ds["valid_ratio"][i] = totals['valid_hours'] / data_hours
+            for name in self.curve_names:
+                self.ds[f"cf_{name}"][i] = totals[f'flh_{name}'] / data_hours
+        if i == self.n_years:
+            self.year_index[year] = i
+            self.n_years += 1
+        key = f"fingerprint_{year}"
+        if fingerprint is not None:
+            self.ds.setncattr(key, fingerprint)
+        elif key in self.ds.ncattrs():
+            self.ds.delncattr(key)
+        self.fingerprints[year] = fingerprint
+        self.ds.sync()
+
+    def close(self):
+        self.ds.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def add_month(totals, result):
+    """把单月结果累加到年度合计中"""
+    if totals is None:
+        return {key: values.astype(np.int16) if key == 'land' else values.copy() for key, values in result.items()}
+    for key, values in result.items():
+        totals[key] += values
+    return totals
@@ -0,0 +1,393 @@
+import os
+import numpy as np
+import netCDF4 as nc
+
+# ----------------------
+# 风速文件约定
+# ----------------------
+FILL_VALUE = -9999.0
+TIME_UNITS = "hours since 1900-01-01 00:00:00"
+TIME_CALENDAR = "standard"
+LEGACY_TIME_UNITS = "YYYYMMDD"  # 旧文件只存 dataDate，小时隐含在 endStep 的顺序中
+
+_EPOCH = np.datetime64("1900-01-01T00", "h")
+
+
+# ----------------------
+# 时间坐标
+# ----------------------
+def encode_times(valid_dates):
+    """将 datetime 列表编码为 CF 的 'hours since 1900-01-01' 整数"""
+    times = np.asarray(valid_dates, dtype="datetime64[h]")
+    return (times - _EPOCH).astype(np.int32)
+
+
+def legacy_hours(dates):
+    """旧文件中同一天的记录按 endStep 升序写入，小时即该日期在文件中出现的序号"""
+    hours = np.zeros(len(dates), dtype=np.int64)
+    seen = {}
+    for i, date in enumerate(np.asarray(dates, dtype=np.int64).tolist()):
+        hours[i] = seen.get(date, 0)
+        seen[date] = hours[i] + 1
+    return hours
+
+
+def decode_times(time_var):
+    """读取 time 变量并返回 datetime64[h] 数组，同时兼容 CF 时间和旧的 YYYYMMDD 格式"""
+    units = getattr(time_var, "units", "")
+    values = np.asarray(time_var[:])
+    if units == LEGACY_TIME_UNITS:
+        dates = values.astype(np.int64)
+        days = np.array([f"{d // 10000:04d}-{d // 100 % 100:02d}-{d % 100:02d}" for d in dates.tolist()],
+                        dtype="datetime64[D]")
+        return days.astype("datetime64[h]") + legacy_hours(dates).astype("timedelta64[h]")
+    calendar = getattr(time_var, "calendar", TIME_CALENDAR)
+    dates = nc.num2date(values, units, calendar,
+                        only_use_cftime_datetimes=False, only_use_python_datetimes=True)
+    return np.array(dates, dtype="datetime64[h]")
+
+
+def upgrade_legacy_time(time_var):
+    """将旧文件的 YYYYMMDD 时间原地改写为 CF 逐小时时间"""
+    times = decode_times(time_var)
+    time_var[:] = (times - _EPOCH).astype(np.int32)
+    time_var.units = TIME_UNITS
+    time_var.calendar = TIME_CALENDAR
+    time_var.standard_name = "time"
+
+
+# ----------------------
+# 按时间窗口读取
+# ----------------------
+def mask_to_ranges(mask):
+    """将布尔掩码转换为连续的 [start, stop) 索引区间列表"""
+    mask = np.asarray(mask, dtype=bool)
+    edges = np.diff(np.concatenate(([False], mask, [False])).astype(np.int8))
+    starts = np.flatnonzero(edges == 1)
+    stops = np.flatnonzero(edges == -1)
+    return list(zip(starts.tolist(), stops.tolist()))
+
+
+def time_ranges(times, months=None, hours=None, start=None, end=None, predicate=None):
+    """
+    将时间条件转换为索引区间
+
+    例如 12-2 月 17:00-20:00：time_ranges(times, months=(12, 1, 2), hours=range(17, 21))
+
+    Args:
+        times: decode_times 返回的 datetime64[h] 数组
+        months: 允许的月份集合
+        hours: 允许的小时集合
+        start, end: 闭区间的起止时间（可为字符串或 datetime64）
+        predicate: 额外的条件函数，输入 times 返回布尔数组
+
+    Returns:
+        List[Tuple[int, int]]: 连续的 [start, stop) 索引区间
+    """
+    times = np.asarray(times, dtype="datetime64[h]")
+    mask = np.ones(len(times), dtype=bool)
+    if months is not None:
+        month_of = times.astype("datetime64[M]").astype(np.int64) % 12 + 1
+        mask &= np.isin(month_of, list(months))
+    if hours is not None:
+        hour_of = (times - times.astype("datetime64[D]")).astype(np.int64)
+        mask &= np.isin(hour_of, list(hours))
+    if start is not None:
+        mask &= times >= np.datetime64(start, "h")
+    if end is not None:
+        mask &= times <= np.datetime64(end, "h")
+    if predicate is not None:
+        mask &= np.asarray(predicate(times), dtype=bool)
+    return mask_to_ranges(mask)
+
+
+def read_time_window(var, ranges, *index):
+    """只读取所需时间区间的超立方体，index 为其余维度的索引（如 lat/lon 切片）"""
+    if not ranges:
+        return var[(slice(0, 0),) + index]
+    parts = [var[(slice(a, b),) + index] for a, b in ranges]
+    if any(isinstance(part, np.ma.MaskedArray) for part in parts):
+        return np.ma.concatenate(parts, axis=0)
+    return np.concatenate(parts, axis=0)
+
+
+# ----------------------
+# 逐时刻统计
+# ----------------------
+# 逐时刻统计变量：名称 -> (类型, 缺测标记, 说明)
+SUMMARY_VARIABLES = {
+    "ws_min": ("f4", -9999.0, "minimum wind speed over valid cells"),
+    "ws_max": ("f4", -9999.0, "maximum wind speed over valid cells"),
+    "ws_mean": ("f4", -9999.0, "mean wind speed over valid cells"),
+    "fill_count": ("i4", -1, "number of cells set to the fill value"),
+    "valid_count": ("i4", -1, "number of valid cells"),
+}
+
+
+def ensure_summary_variables(ds):
+    """确保文件中存在逐时刻统计变量（旧文件在追加模式下补建，旧时刻保持缺测标记）"""
+    for name, (dtype, fill_value, long_name) in SUMMARY_VARIABLES.items():
+        if name not in ds.variables:
+            var = ds.createVariable(name, dtype, ("time",), fill_value=fill_value)
+            var.long_name = long_name
+            if dtype == "f4":
+                var.units = "m/s"
+    return {name: ds.variables[name] for name in SUMMARY_VARIABLES}
+
+
+def summarize_timestep(ws, valid_mask):
+    """计算单个时刻的统计量，没有有效格点时最小/最大/平均值记为 NaN"""
+    valid = ws[valid_mask]
+    n_valid = int(valid.size)
+    if n_valid:
+        ws_min, ws_max, ws_mean = valid.min(), valid.max(), valid.mean(dtype=np.float64)
+    else:
+        ws_min = ws_max = ws_mean = np.nan
+    return {
+        "ws_min": ws_min,
+        "ws_max": ws_max,
+        "ws_mean": ws_mean,
+        "fill_count": int(ws.size - n_valid),
+        "valid_count": n_valid,
+    }
+
+
+def update_file_summary(ds):
+    """根据逐时刻统计重新计算文件级汇总，写入全局属性"""
+    ds.set_auto_mask(False)
+    valid_count = ds.variables["valid_count"][:].astype(np.int64)
+    fill_count = ds.variables["fill_count"][:].astype(np.int64)
+    ws_min = ds.variables["ws_min"][:]
+    ws_max = ds.variables["ws_max"][:]
+    ws_mean = ds.variables["ws_mean"][:].astype(np.float64)
+    recorded = valid_count >= 0
+    has_valid = recorded & (valid_count > 0)
+    ds.summary_n_times = np.int32(len(valid_count))
+    ds.summary_n_recorded = np.int32(recorded.sum())
+    ds.summary_valid_cells = np.int64(valid_count[recorded].sum())
+    ds.summary_fill_cells = np.int64(fill_count[recorded].sum())
+    if has_valid.any():
+        ds.summary_ws_min = np.float32(ws_min[has_valid].min())
+        ds.summary_ws_max = np.float32(ws_max[has_valid].max())
+        weights = valid_count[has_valid]
+        ds.summary_ws_mean = np.float32((ws_mean[has_valid] * weights).sum() / weights.sum())
+    ds.set_auto_mask(True)
+
+
+def backfill_summaries(path, block_size=24):
+    """
+    为已有文件补写逐时刻统计（一次性处理转换时未记录统计的旧文件）
+
+    只计算尚未记录的时刻（valid_count 为缺测标记），按时间块读取风速，
+    结果与转换时写入的统计完全相同。
+
+    Returns:
+        int: 本次补写的时刻数
+    """
+    # 先只读检查，已完整的文件不以写模式打开，避免修改时间变化使下游缓存失效
+    with nc.Dataset(path, "r") as ds:
+        ds.set_auto_mask(False)
+        if "valid_count" in ds.variables and not (ds.variables["valid_count"][:] < 0).any():
+            return 0
+    with nc.Dataset(path, "a") as ds:
+        summary_vars = ensure_summary_variables(ds)
+        ds.set_auto_mask(False)
+        missing = summary_vars["valid_count"][:] < 0
+        if missing.any():
+            ws_var = ds.variables["wind_speed"]
+            for start, stop in mask_to_ranges(missing):
+                for t0 in range(start, stop, block_size):
+                    t1 = min(t0 + block_size, stop)
+                    block = ws_var[t0:t1]
+                    for t in range(t1 - t0):
+                        ws = block[t]
+                        stats = summarize_timestep(ws, (ws != FILL_VALUE) & ~np.isnan(ws))
+                        for name, value in stats.items():
+                            summary_vars[name][t0 + t] = value
+        update_file_summary(ds)
+    return int(missing.sum())
+
+
+# ----------------------
+# 快速读取（关闭自动掩码）
+# ----------------------
+def normalize_lon(lon):
+    """经度统一到 [0, 360)，与 ERA5 风速网格一致"""
+    return np.mod(lon, 360)
+
+
+def fill_to_nan(block, fill_value=FILL_VALUE):
+    """原地将缺测标记替换为 NaN，不生成掩码数组"""
+    block[block == fill_value] = np.nan
+    return block
+
+
+class ReadPlan:
+    """
+    稀疏像元的读取计划
+
+    把需要的像元按文件的分块（连续存储时按纬度行）分组，每组只读取组内像元的包围盒，
+    避免为了少量像元读取并分配整幅网格。
+
+    Attributes:
+        boxes (list): (纬度切片, 经度切片, 像元位置, 盒内纬度索引, 盒内经度索引)
+        bytes_read (int): 每个时刻需要解压/读取的字节数（按涉及的整块计算）
+        bytes_allocated (int): 每个时刻分配的包围盒字节数
+        bytes_used (int): 每个时刻实际使用的字节数
+    """
+
+    def __init__(self, lat_idx, lon_idx, grid_shape, chunk_shape=None, itemsize=4):
+        lat_idx = np.asarray(lat_idx, dtype=np.int64)
+        lon_idx = np.asarray(lon_idx, dtype=np.int64)
+        n_lat, n_lon = grid_shape
+        # 连续存储时按纬度行合并，分块存储时按块对齐
+        tile_lat, tile_lon = chunk_shape if chunk_shape is not None else (1, n_lon)
+        n_tile_lon = -(-n_lon // tile_lon)
+        tile_id = (lat_idx // tile_lat) * n_tile_lon + lon_idx // tile_lon
+
+        order = np.argsort(tile_id, kind="stable")
+        splits = np.flatnonzero(np.diff(tile_id[order])) + 1
+        self.boxes = []
+        box_cells = 0
+        tile_cells = 0
+        for positions in np.split(order, splits):
+            if not len(positions):
+                continue
+            la, lo = lat_idx[positions], lon_idx[positions]
+            lat0, lat1 = int(la.min()), int(la.max()) + 1
+            lon0, lon1 = int(lo.min()), int(lo.max()) + 1
+            self.boxes.append((slice(lat0, lat1), slice(lon0, lon1), positions, la - lat0, lo - lon0))
+            box_cells += (lat1 - lat0) * (lon1 - lon0)
+            if chunk_shape is None:
+                tile_cells += (lat1 - lat0) * (lon1 - lon0)
+            else:
+                t_lat0 = lat0 // tile_lat * tile_lat
+                t_lon0 = lon0 // tile_lon * tile_lon
+                tile_cells += (min(t_lat0 + tile_lat, n_lat) - t_lat0) * (min(t_lon0 + tile_lon, n_lon) - t_lon0)
+
+        self.n_points = len(lat_idx)
+        self.bytes_read = tile_cells * itemsize
+        self.bytes_allocated = box_cells * itemsize
+        self.bytes_used = len(np.unique(lat_idx * n_lon + lon_idx)) * itemsize
+
+    def read(self, var, start, stop, out):
+        """读取 [start, stop) 时刻的所有包围盒，并把像元写入 out (time × 像元)"""
+        for lat_slice, lon_slice, positions, local_lat, local_lon in self.boxes:
+            block = var[start:stop, lat_slice, lon_slice]
+            out[:, positions] = block[:, local_lat, local_lon]
+        return out
+
+    def summary(self):
+        return (f"{len(self.boxes)} 个读取块，每个时刻读取 {self.bytes_read / 1024 ** 2:.2f} MB，"
+                f"分配 {self.bytes_allocated / 1024 ** 2:.2f} MB，实际使用 {self.bytes_used / 1024:.1f} KB")
+
+
+class WindCube:
+    """
+    单个月份风速文件的读取器
+
+    关闭 netCDF4 的自动掩码，直接读取原始 float32 数据，缺测值原地替换为 NaN，
+    风电场像元提取到可复用的缓冲区中，避免每个批次都生成掩码数组和新的大数组。
+
+    Attributes:
+        ds: netCDF4.Dataset
+        var: 风速变量
+        fill_value (float): 缺测标记
+        lat (np.ndarray): 纬度
+        lon (np.ndarray): 经度（已统一到 [0, 360)）
+        n_time (int): 时刻数
+        bytes_read, bytes_used (int): 按像元提取时累计读取和实际使用的字节数，关闭时输出两者之比
+    """
+
+    def __init__(self, path, var_name="wind_speed"):
+        self.path = path
+        self.ds = nc.Dataset(path, "r")
+        self.ds.set_auto_maskandscale(False)
+        self.var = self.ds.variables[var_name]
+        self.fill_value = getattr(self.var, "_FillValue", FILL_VALUE)
+        self.lat = np.asarray(self.ds.variables["lat"][:])
+        self.lon = normalize_lon(np.asarray(self.ds.variables["lon"][:]))
+        self.n_time = self.var.shape[0]
+        self._point_buffer = None
+        self.bytes_read = 0
+        self.bytes_used = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.ds.close()
+        if self.bytes_used:
+            print(f"{os.path.basename(str(self.path))}: 读取 {self.bytes_read / 1024 ** 2:.1f} MB，"
+                  f"使用 {self.bytes_used / 1024:.1f} KB（{self.bytes_read / self.bytes_used:.1f} 倍）")
+
+    @property
+    def times(self):
+        return decode_times(self.ds.variables["time"])
+
+    def _blocks(self, block_size, ranges):
+        """将时间区间切分为不超过 block_size 的批次"""
+        for a, b in (ranges if ranges is not None else [(0, self.n_time)]):
+            for start in range(a, b, block_size):
+                yield start, min(start + block_size, b)
+
+    def iter_blocks(self, block_size=48, ranges=None):
+        """按批次读取整幅网格，返回 (start, stop, block)，block 中缺测值为 NaN"""
+        for start, stop in self._blocks(block_size, ranges):
+            yield start, stop, fill_to_nan(self.var[start:stop], self.fill_value)
+
+    def plan(self, lat_idx, lon_idx):
+        """根据文件的分块方式为指定像元生成读取计划"""
+        chunking = self.var.chunking()
+        chunk_shape = None if chunking == "contiguous" else tuple(chunking[1:])
+        return ReadPlan(lat_idx, lon_idx, self.var.shape[1:], chunk_shape, self.var.dtype.itemsize)
+
+    def iter_point_blocks(self, lat_idx, lon_idx, block_size=48, ranges=None, plan=None):
+        """
+        按批次提取指定像元，返回 (start, stop, points)
+
+        只读取读取计划中的包围盒而不是整幅网格。
+        points 为 (time × 像元) 的 float32 数组，是内部缓冲区的视图，
+        下一个批次会覆盖它，需要保留时请自行复制。
+        """
+        plan = plan or self.plan(lat_idx, lon_idx)
+        shape = (block_size, plan.n_points)
+        if self._point_buffer is None or self._point_buffer.shape != shape:
+            self._point_buffer = np.empty(shape, dtype=np.float32)
+        for start, stop in self._blocks(block_size, ranges):
+            points = plan.read(self.var, start, stop, self._point_buffer[:stop - start])
+            self.bytes_read += plan.bytes_read * (stop - start)
+            self.bytes_used += plan.bytes_used * (stop - start)
+            yield start, stop, fill_to_nan(points, self.fill_value)
+
+    def read_points(self, lat_idx, lon_idx, block_size=48, ranges=None, plan=None):
+        """读取指定像元的完整时间序列，返回 (time × 像元) 数组"""
+        n_time = sum(b - a for a, b in ranges) if ranges is not None else self.n_time
+        series = np.empty((n_time, len(lat_idx)), dtype=np.float32)
+        offset = 0
+        for start, stop, points in self.iter_point_blocks(lat_idx, lon_idx, block_size, ranges, plan):
+            series[offset:offset + stop - start] = points
+            offset += stop - start
+        return series
+
+
+def read_grid_coords(path):
+    """只读取文件的经纬度坐标，经度统一到 [0, 360)"""
+    with nc.Dataset(path, "r") as ds:
+        return np.asarray(ds.variables["lat"][:]), normalize_lon(np.asarray(ds.variables["lon"][:]))
+
+
+def unique_pixels(*index_arrays):
+    """
+    按像元索引组合去重（如 风速纬度, 风速经度, z0纬度, z0经度）
+
+    Returns:
+        (unique_indices, first, inverse): 每个维度的唯一索引数组组成的元组、
+        每个唯一组合首次出现的行号、以及把唯一结果广播回原始行的索引（result[inverse]）
+    """
+    keys = np.column_stack([np.asarray(a, dtype=np.int64) for a in index_arrays])
+    unique_keys, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    return tuple(unique_keys.T), first, inverse.ravel()
@@ -0,0 +1,79 @@
+import numpy as np
+import xarray as xr
+
+Z0_VAR = 'Monthly_z0m_25km'
+
+
+# ----------------------
+# 逐年累加
+# ----------------------
+class Z0Accumulator:
+    """
+    同一月份多年粗糙度的流式累加器：每次只读入一个年份的网格
+
+    非正值和 NaN 在累加前就视为缺测，不会把平均值拉低。
+
+    Attributes:
+        total, total_sq (np.ndarray): 有效值及其平方之和（float64）
+        count (np.ndarray): 每个格点的有效年数（int16）
+    """
+
+    def __init__(self):
+        self.total = None
+        self.total_sq = None
+        self.count = None
+        self.lat = self.lon = None
+
+    def add(self, z0):
+        z0 = np.asarray(z0, dtype=np.float64)
+        valid = z0 > 0
+        values = np.where(valid, z0, 0.0)
+        if self.total is None:
+            self.total = np.zeros(z0.shape)
+            self.total_sq = np.zeros(z0.shape)
+            self.count = np.zeros(z0.shape, dtype=np.int16)
+        self.total += values
+        self.total_sq += values * values
+        self.count += valid
+
+    def add_file(self, path):
+        with xr.open_dataset(path) as ds:
+            if self.lat is None:
+                self.lat, self.lon = ds.lat.values, ds.lon.values
+            self.add(np.squeeze(ds[Z0_VAR].values))
+
+    def result(self):
+        """(平均值, 标准差, 有效年数)，没有有效值的格点平均值和标准差为 NaN"""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            n = np.where(self.count > 0, self.count, np.nan)
+            mean = self.total / n
+            std = np.sqrt(np.maximum(self.total_sq / n - mean * mean, 0.0))
+        return mean, std, self.count
+
+
+def month_climatology(files, output_file):
+    """
+    计算某一月份的多年平均粗糙度并保存（在子进程中运行）
+
+    输出文件中 Monthly_z0m_25km 为平均值（与原始文件同名，可直接替代当月粗糙度），
+    另有 z0_std（年际标准差）和 z0_count（参与平均的年数），用于判断平均值的可靠程度。
+    """
+    acc = Z0Accumulator()
+    for path in sorted(files):
+        acc.add_file(path)
+    mean, std, count = acc.result()
+    coords = {'lat': acc.lat, 'lon': acc.lon}
+    dims = ('lat', 'lon')
+    ds = xr.Dataset(
+        {
+            Z0_VAR: xr.DataArray(mean.astype(np.float32), coords, dims),
+            'z0_std': xr.DataArray(std.astype(np.float32), coords, dims,
+                                   attrs={'long_name': 'interannual standard deviation of z0'}),
+            'z0_count': xr.DataArray(count, coords, dims,
+                                     attrs={'long_name': 'number of years with valid z0'}),
+        },
+        attrs={'source_files': len(files)},
+    )
+    encoding = {name: {'zlib': True, 'complevel': 5} for name in ds.data_vars}
+    ds.to_netcdf(output_file, encoding=encoding)
+    return output_file
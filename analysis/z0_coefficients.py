@@ -0,0 +1,171 @@
+import numpy as np
+import xarray as xr
+from pathlib import Path
+from functools import partial
+
+from fingerprint import files_fingerprint
+from pipeline import stage_pool
+from wind_reader import unique_pixels
+
+REFERENCE_HEIGHT = 10  # ERA5 风速高度（m）
+
+
+# ----------------------
+# 风速高度修正系数
+# ----------------------
+def height_coefficients(z0, heights, reference_height=REFERENCE_HEIGHT):
+    """
+    对数风廓线修正系数 ln(h / z0) / ln(reference_height / z0)
+
+    Args:
+        z0: 粗糙度数组（float64）
+        heights: 轮毂高度列表
+
+    Returns:
+        np.ndarray: (高度 × z0.shape)
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.stack([np.log(h / z0) / np.log(reference_height / z0) for h in heights])
+
+
+def height_columns(name, heights):
+    """各高度的输出列名：只有一个高度时保持原列名，否则为 {name}_{h}m"""
+    if len(heights) == 1:
+        return [name]
+    return [f"{name}_{h:g}m" for h in heights]
+
+
+def count_band_hours(u10, adjustment, low=5, high=20, block_size=168):
+    """
+    按 (高度 × time × 像元) 广播修正系数，统计各高度风速落在 [low, high] 内的小时数
+
+    按时间分块计算，临时数组大小与高度数成正比而与月份长度无关。
+
+    Args:
+        u10: (time × 像元) 10 m 风速，缺测为 NaN
+        adjustment: (高度 × 像元) 修正系数
+
+    Returns:
+        np.ndarray: (高度 × 像元) int64
+    """
+    counts = np.zeros(adjustment.shape, dtype=np.int64)
+    for start in range(0, len(u10), block_size):
+        u = u10[start:start + block_size][None, :, :] * adjustment[:, None, :]
+        counts += np.sum((u >= low) & (u <= high), axis=1)
+    return counts
+
+
+def read_z0_points(z0_file, lat_idx, lon_idx):
+    """读取粗糙度文件中指定像元的 z0（非正值视为缺测，返回 NaN）"""
+    with xr.open_dataset(z0_file) as z0_data:
+        z0_values = z0_data['Monthly_z0m_25km'].where(z0_data['Monthly_z0m_25km'] > 0)
+        return z0_values.values[lat_idx, lon_idx].astype(np.float64)
+
+
+# ----------------------
+# 系数表
+# ----------------------
+class CoefficientTable:
+    """
+    (年月 × 高度 × 唯一粗糙度像元) 的修正系数表
+
+    多个年月共用同一个粗糙度文件时（例如使用多年月平均的年份）只保存一份，
+    rows 记录每个年月对应的行。粗糙度无效的像元系数为 NaN。
+
+    Attributes:
+        months (list): 'YYYY-MM'
+        rows (np.ndarray): 每个年月在 coeff 中的行号
+        coeff (np.ndarray): (粗糙度文件 × 高度 × 粗糙度像元) float64
+        pixel (np.ndarray): 每个查询像元对应的粗糙度像元
+        heights (list): 轮毂高度
+        fingerprint (str): 粗糙度文件、像元索引和高度的指纹
+    """
+
+    def __init__(self, months, rows, coeff, pixel, heights, fingerprint):
+        self.months = list(months)
+        self.rows = np.asarray(rows)
+        self.coeff = coeff
+        self.pixel = pixel
+        self.heights = list(heights)
+        self.fingerprint = fingerprint
+        self._row_of = dict(zip(self.months, self.rows.tolist()))
+
+    def __contains__(self, year_month):
+        return self._key(*year_month) in self._row_of
+
+    @staticmethod
+    def _key(year, month):
+        return f"{year}-{month:02d}"
+
+    def get(self, year, month):
+        """返回 (高度 × 查询像元) 的修正系数"""
+        return self.coeff[self._row_of[self._key(year, month)]][:, self.pixel]
+
+    def save(self, path):
+        """先写临时文件再替换，中断时不会留下被当作有效缓存的不完整文件"""
+        path = Path(path)
+        tmp_path = path.with_name(path.name + '.tmp.npz')
+        np.savez(tmp_path, months=np.array(self.months, dtype=str), rows=self.rows, coeff=self.coeff,
+                 pixel=self.pixel, heights=np.array(self.heights, dtype=np.float64),
+                 fingerprint=np.array(self.fingerprint))
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['months'].tolist(), data['rows'], data['coeff'], data['pixel'],
+                       data['heights'].tolist(), str(data['fingerprint']))
+
+
+def build_coefficient_table(month_files, z_lat_idx, z_lon_idx, heights, max_workers=None):
+    """
+    并行读取各粗糙度文件并计算修正系数表
+
+    Args:
+        month_files: {(year, month): 粗糙度文件路径}，不存在的文件会被跳过
+        z_lat_idx, z_lon_idx: 查询像元的粗糙度网格索引
+        heights: 轮毂高度列表
+    """
+    month_files = {key: Path(path) for key, path in sorted(month_files.items()) if Path(path).exists()}
+    files = sorted(set(month_files.values()))
+    (u_lat, u_lon), _, pixel = unique_pixels(z_lat_idx, z_lon_idx)
+
+    with stage_pool(max_workers=max_workers) as executor:
+        z0 = list(executor.map(partial(read_z0_points, lat_idx=u_lat, lon_idx=u_lon), files))
+    coeff = np.stack([height_coefficients(values, heights) for values in z0]) if files \
+        else np.empty((0, len(heights), len(u_lat)))
+
+    file_row = {path: i for i, path in enumerate(files)}
+    months = [CoefficientTable._key(*key) for key in month_files]
+    rows = [file_row[path] for path in month_files.values()]
+    return CoefficientTable(months, rows, coeff, pixel, heights,
+                            coefficient_fingerprint(month_files, z_lat_idx, z_lon_idx, heights))
+
+
+def coefficient_fingerprint(month_files, z_lat_idx, z_lon_idx, heights):
+    """粗糙度文件签名、年月到文件的对应关系、像元索引和高度共同决定系数表"""
+    existing = {key: Path(path) for key, path in month_files.items() if Path(path).exists()}
+    return files_fingerprint(
+        set(existing.values()),
+        sorted((f"{y}-{m:02d}", p.name) for (y, m), p in existing.items()),
+        np.asarray(z_lat_idx, dtype=np.int64), np.asarray(z_lon_idx, dtype=np.int64),
+        [float(h) for h in heights], REFERENCE_HEIGHT,
+    )
+
+
+def load_coefficient_table(path, month_files, z_lat_idx, z_lon_idx, heights, max_workers=None):
+    """读取缓存的系数表，粗糙度输入、像元或高度有变化时重新计算并保存"""
+    path = Path(path)
+    expected = coefficient_fingerprint(month_files, z_lat_idx, z_lon_idx, heights)
+    if path.exists():
+        try:
+            table = CoefficientTable.load(path)
+        except Exception as e:
+            print(f"修正系数表 {path.name} 无法读取，重新计算: {str(e)}")
+        else:
+            if table.fingerprint == expected:
+                return table
+            print("粗糙度输入、像元或轮毂高度已变化，重新计算修正系数表")
+    table = build_coefficient_table(month_files, z_lat_idx, z_lon_idx, heights, max_workers)
+    table.save(path)
+    return table